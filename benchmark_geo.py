@@ -0,0 +1,74 @@
+"""
+Сравнение поиска медцентров в радиусе: линейный проход с гаверсинусом,
+пакетный расчет haversine_many по всем центрам и сетка GridIndex.
+Запуск: python benchmark_geo.py
+"""
+
+import random
+import time
+
+from geo import GridIndex, haversine, haversine_many, np
+
+RADIUS_KM = 50
+QUERIES = 200
+SIZES = (1_000, 10_000, 100_000)
+
+# Примерно территория Беларуси и западной части России
+LAT_RANGE = (51.0, 60.0)
+LON_RANGE = (23.0, 45.0)
+
+
+def random_point(rng):
+    return rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+
+
+def linear_scan(centers, lat, lon, radius_km):
+    found = []
+    for mc_id, (c_lat, c_lon) in centers.items():
+        distance = haversine(lat, lon, c_lat, c_lon)
+        if distance <= radius_km:
+            found.append((distance, mc_id))
+    found.sort()
+    return found
+
+
+def batched_scan(ids, lats, lons, lat, lon, radius_km):
+    distances, mask = haversine_many(lat, lon, lats, lons, radius_km)
+    return sorted((float(distance), mc_id) for distance, mc_id, inside in zip(distances, ids, mask) if inside)
+
+
+def measure(func, points):
+    started = time.perf_counter()
+    results = [func(lat, lon) for lat, lon in points]
+    return (time.perf_counter() - started) / len(points) * 1000, results
+
+
+def main():
+    rng = random.Random(42)
+    points = [random_point(rng) for _ in range(QUERIES)]
+    print(f"numpy: {'есть' if np is not None else 'нет, пакетный расчет на чистом Python'}")
+    print(f"{'центров':>10} {'линейно, мс':>14} {'пакетно, мс':>14} {'сетка, мс':>12} {'найдено':>9}")
+
+    for size in SIZES:
+        centers = {mc_id: random_point(rng) for mc_id in range(size)}
+        index = GridIndex()
+        index.load({'id': mc_id, 'latitude': lat, 'longitude': lon} for mc_id, (lat, lon) in centers.items())
+
+        linear_ms, expected = measure(lambda lat, lon: linear_scan(centers, lat, lon, RADIUS_KM), points)
+        ids = list(centers)
+        lats = [centers[mc_id][0] for mc_id in ids]
+        lons = [centers[mc_id][1] for mc_id in ids]
+        if np is not None:
+            lats, lons = np.array(lats), np.array(lons)
+        batched_ms, _ = measure(lambda lat, lon: batched_scan(ids, lats, lons, lat, lon, RADIUS_KM), points)
+        grid_ms, actual = measure(lambda lat, lon: index.within(lat, lon, RADIUS_KM), points)
+        # numpy и math могут расходиться в последних знаках, сравниваем найденные id
+        assert [{i for _, i in r} for r in actual] == [{i for _, i in r} for r in expected], \
+            "Результаты сетки и линейного прохода расходятся"
+
+        found = sum(len(r) for r in actual) / len(actual)
+        print(f"{size:>10} {linear_ms:>14.3f} {batched_ms:>14.3f} {grid_ms:>12.3f} {found:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,29 @@
 import os
+import asyncio
 import logging
 import hashlib
-import math
-from datetime import datetime, timedelta, date
+import bisect
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, \
-    ConversationHandler
-import psycopg2
-from psycopg2.extras import RealDictCursor
+    ConversationHandler, TypeHandler
 from dotenv import load_dotenv
 
+from broadcast import Broadcaster
+from certificates import EXPIRED_MESSAGE, days_valid, expire_certificates
+from cities import city_key
+from compatibility import donor_types, recipient_types
+from eligibility import DONATION_INTERVAL_DAYS, ELIGIBLE_SQL, days_left
+from geo import distance_sql, haversine, radius_condition
+from outbox import Outbox
+from persistence import PostgresPersistence
+from reminders import queue_reminders
+from services import Services
+from stats import load_recent_requests, load_stats, refresh_stats
+from traffic_light import keyboard as traffic_light_keyboard
+from update_processor import ChatOrderedUpdateProcessor
+from user_functions import UserFunctions
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -35,16 +49,22 @@ MASTER_PASSWORD = "doctor2024"
 
 
 class BloodDonorBot:
-    def __init__(self):
-        self.db_config = {
-            'host': os.getenv('DB_HOST', 'localhost'),
-            'database': os.getenv('DB_NAME', 'blood_donor_bot'),
-            'user': os.getenv('DB_USER', 'postgres'),
-            'password': os.getenv('DB_PASSWORD', 'vadamahjkl'),
-            'port': os.getenv('DB_PORT', '5432')
-        }
+    def __init__(self, services: Services = None):
+        # Пул соединений, кэши и индексы общие с UserFunctions
+        self.services = services or Services.from_env()
+        self.db_config = self.services.db_config
+        self.pool = self.services.pool
+        self.db = self.services.db
+        self.centers_index = self.services.centers_index
+        self.traffic_lights = self.services.traffic_lights
+        self.needs_board = self.services.needs_board
+        self.relevant_requests_cache = self.services.relevant_requests_cache
+        self.user_cache = self.services.user_cache
         self.application = None
-        self.init_database()
+        self.broadcaster = None
+        self.outbox = None
+        self.user_functions = UserFunctions(self.services, self)
+        self.services.init_database()
 
     def calculate_distance(self, lat1, lon1, lat2, lon2):
         """
@@ -53,145 +73,63 @@ class BloodDonorBot:
         if not lat1 or not lon1 or not lat2 or not lon2:
             return None
 
-        R = 6371  # Радиус Земли в км
-
-        d_lat = math.radians(lat2 - lat1)
-        d_lon = math.radians(lon2 - lon1)
-        
-        a = (math.sin(d_lat / 2) * math.sin(d_lat / 2) +
-             math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-             math.sin(d_lon / 2) * math.sin(d_lon / 2))
-        
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        
-        d = R * c
-        return d
-
-    def get_db_connection(self):
-        """Создает соединение с базой данных"""
-        return psycopg2.connect(**self.db_config)
-
-    def init_database(self):
-        """Инициализирует базу данных"""
-        try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-
-            # Создание таблицы пользователей
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    role VARCHAR(20) NOT NULL CHECK (role IN ('user', 'doctor')),
-                    blood_type VARCHAR(10),
-                    location VARCHAR(255),
-                    last_donation_date DATE,
-                    is_registered BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Обновление таблицы users (новые колонки)
-            alter_commands = [
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS city VARCHAR(100)",
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS latitude FLOAT",
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS longitude FLOAT",
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS medical_certificate_file_id VARCHAR(255)",
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS medical_certificate_date DATE",
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_number VARCHAR(20)",
-                "ALTER TABLE users ADD COLUMN IF NOT EXISTS medical_center_id INTEGER REFERENCES medical_centers(id)"
-            ]
-            for cmd in alter_commands:
-                try:
-                    cursor.execute(cmd)
-                except psycopg2.errors.DuplicateColumn:
-                    conn.rollback()
-                except Exception as e:
-                    logger.warning(f"Alter table warning: {e}")
-                    conn.rollback()
-                else:
-                    conn.commit()
-
-            # Обновление таблицы donation_requests (новые колонки)
-            alter_requests_commands = [
-                "ALTER TABLE donation_requests ADD COLUMN IF NOT EXISTS medical_center_id INTEGER REFERENCES medical_centers(id)",
-                "ALTER TABLE donation_requests ADD COLUMN IF NOT EXISTS hospital_name VARCHAR(255)",
-                "ALTER TABLE donation_requests ADD COLUMN IF NOT EXISTS contact_info TEXT"
-            ]
-            for cmd in alter_requests_commands:
-                try:
-                    cursor.execute(cmd)
-                    conn.commit()
-                except Exception as e:
-                    logger.warning(f"Alter table donation_requests warning: {e}")
-                    conn.rollback()
-
-            # Создание таблицы медицинских центров
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS medical_centers (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    address VARCHAR(255) NOT NULL,
-                    city VARCHAR(100) NOT NULL,
-                    latitude FLOAT,
-                    longitude FLOAT,
-                    login VARCHAR(50) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    contact_info TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Создание таблицы потребностей крови
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS blood_needs (
-                    id SERIAL PRIMARY KEY,
-                    medical_center_id INTEGER REFERENCES medical_centers(id),
-                    blood_type VARCHAR(10) NOT NULL,
-                    status VARCHAR(20) DEFAULT 'ok',
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(medical_center_id, blood_type)
-                )
-            """)
-
-            # Таблица откликов доноров
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS donation_responses (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(telegram_id),
-                    medical_center_id INTEGER REFERENCES medical_centers(id),
-                    status VARCHAR(20) DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Старая таблица запросов (оставляем для совместимости или истории)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS donation_requests (
-                    id SERIAL PRIMARY KEY,
-                    doctor_id BIGINT NOT NULL,
-                    medical_center_id INTEGER REFERENCES medical_centers(id),
-                    blood_type VARCHAR(10) NOT NULL,
-                    location VARCHAR(255) NOT NULL,
-                    address VARCHAR(255) NOT NULL,
-                    hospital_name VARCHAR(255),
-                    contact_info TEXT,
-                    request_date DATE NOT NULL,
-                    description TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (doctor_id) REFERENCES users(telegram_id)
-                )
-            """)
-
-            conn.commit()
-            cursor.close()
-            conn.close()
-            logger.info("База данных инициализирована успешно")
-        except Exception as e:
-            logger.error(f"Ошибка инициализации базы данных: {e}")
+        return haversine(lat1, lon1, lat2, lon2)
+
+    def nearby_centers(self, lat, lon, radius_km=50):
+        """Медцентры в радиусе radius_km: {id: расстояние в км}, ближайшие первыми"""
+        return {mc_id: distance for distance, mc_id in self.centers_index.within(lat, lon, radius_km)}
+
+    async def load_centers_index(self):
+        """Загружает координаты медцентров в индекс в памяти"""
+        rows = await self.db.fetchall("""
+            SELECT id, latitude, longitude FROM medical_centers
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """)
+        self.centers_index.load(rows)
+        logger.info(f"Индекс медцентров загружен: {len(self.centers_index)}")
+
+    async def load_needs_board(self):
+        """Загружает доску потребностей для донорского светофора"""
+        centers = await self.db.fetchall("SELECT id, name, city, latitude, longitude FROM medical_centers")
+        needs = await self.db.fetchall("""
+            SELECT medical_center_id, blood_type, status FROM blood_needs
+            WHERE status IN ('need', 'urgent')
+        """)
+        self.needs_board.load(centers, needs)
+        logger.info(f"Доска потребностей загружена: медцентров с потребностями {len(self.needs_board)}")
+
+    async def refresh_center(self, mc_id, notify=True):
+        """Обновляет медцентр в индексе и на доске потребностей после изменения в базе"""
+        mc = await self.db.fetchone(
+            "SELECT name, city, latitude, longitude FROM medical_centers WHERE id = %s", (mc_id,))
+        if mc:
+            self.centers_index.upsert(mc_id, mc['latitude'], mc['longitude'])
+            self.needs_board.set_center(mc_id, mc)
+        else:
+            self.centers_index.remove(mc_id)
+            self.needs_board.remove_center(mc_id)
+        self.relevant_requests_cache.clear()
+        if notify:
+            self.services.notify('center', id=mc_id)
+
+    async def apply_need_change(self, data):
+        """Статус светофора, измененный на другой реплике"""
+        mc_id = data['mc_id']
+        self.traffic_lights.invalidate(mc_id)
+        if not self.needs_board.knows(mc_id):
+            await self.refresh_center(mc_id, notify=False)
+        self.needs_board.set_status(mc_id, data['blood_type'], data['status'])
+
+    async def reload_shared_state(self, data=None):
+        """Перечитывает индексы после потери связи с другими репликами"""
+        await self.load_centers_index()
+        await self.load_needs_board()
+
+    async def get_user_profile(self, user_id):
+        return await self.services.get_user_profile(user_id)
+
+    def invalidate_user(self, user_id):
+        self.services.invalidate_user(user_id)
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начальная команда бота"""
@@ -199,12 +137,8 @@ class BloodDonorBot:
         logger.info(f"Пользователь {user.id} ({user.first_name}) запустил бота")
 
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
             # Проверяем, зарегистрирован ли пользователь
-            cursor.execute("SELECT * FROM users WHERE telegram_id = %s", (user.id,))
-            existing_user = cursor.fetchone()
+            existing_user = await self.get_user_profile(user.id)
 
             if existing_user and existing_user['is_registered']:
                 if existing_user['role'] == 'doctor':
@@ -226,9 +160,6 @@ class BloodDonorBot:
                     "Выберите вашу роль:",
                     reply_markup=reply_markup
                 )
-
-            cursor.close()
-            conn.close()
         except Exception as e:
             logger.error(f"Ошибка в start: {e}")
             await update.message.reply_text("Произошла ошибка. Попробуйте позже.")
@@ -245,33 +176,23 @@ class BloodDonorBot:
         if query.data == "role_user":
             # Проверяем, зарегистрирован ли уже пользователь (независимо от текущей роли в БД)
             try:
-                conn = self.get_db_connection()
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                # Ищем пользователя по ID, проверяем флаг регистрации и наличие данных донора
-                cursor.execute("""
-                    SELECT * FROM users 
+                # Ищем пользователя по ID, проверяем флаг регистрации и наличие данных донора.
+                # Если данные донора заполнены, сразу возвращаем ему роль донора
+                returning_user = await self.db.fetchone("""
+                    UPDATE users SET role = 'user'
                     WHERE telegram_id = %s 
                     AND is_registered = TRUE 
                     AND blood_type IS NOT NULL 
                     AND location IS NOT NULL
+                    RETURNING telegram_id
                 """, (update.effective_user.id,))
-                existing_user = cursor.fetchone()
                 
-                if existing_user:
-                    # Если пользователь существует и данные донора заполнены, обновляем роль и пускаем
-                    cursor.execute("UPDATE users SET role = 'user' WHERE telegram_id = %s", (update.effective_user.id,))
-                    conn.commit()
-                    
-                    cursor.close()
-                    conn.close()
-                    
+                if returning_user:
+                    self.invalidate_user(update.effective_user.id)
                     context.user_data['role'] = 'user'
                     await query.edit_message_text("👋 С возвращением в режим донора!")
                     await self.show_user_menu(update, context)
                     return USER_MENU
-                
-                cursor.close()
-                conn.close()
             except Exception as e:
                 logger.error(f"Ошибка проверки регистрации: {e}")
 
@@ -297,8 +218,6 @@ class BloodDonorBot:
         elif query.data == "role_doctor":
             # Проверяем, был ли пользователь уже врачом
             try:
-                conn = self.get_db_connection()
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
                 # Проверяем, был ли пользователь когда-либо зарегистрирован как врач
                 # Здесь мы предполагаем, что если is_registered=TRUE и он был врачом раньше, 
                 # или просто уже прошел проверку пароля ранее
@@ -309,13 +228,9 @@ class BloodDonorBot:
                 # проверим, есть ли запись. Но для врача пароль все же важен.
                 # Если вы хотите пропускать пароль и для врача при повторном входе:
                 
-                cursor.execute("SELECT * FROM users WHERE telegram_id = %s AND role = 'doctor' AND is_registered = TRUE", 
-                             (update.effective_user.id,))
-                existing_doctor = cursor.fetchone()
-                cursor.close()
-                conn.close()
+                profile = await self.get_user_profile(update.effective_user.id)
                 
-                if existing_doctor:
+                if profile and profile['role'] == 'doctor' and profile['is_registered']:
                     context.user_data['role'] = 'doctor'
                     await query.edit_message_text("👨‍⚕️ С возвращением в режим врача!")
                     await self.show_doctor_menu(update, context)
@@ -426,12 +341,7 @@ class BloodDonorBot:
     async def process_mc_reg_login(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         login = update.message.text
         # Check uniqueness
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM medical_centers WHERE login = %s", (login,))
-        exists = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        exists = await self.db.fetchone("SELECT 1 FROM medical_centers WHERE login = %s", (login,))
 
         if exists:
             await update.message.reply_text("❌ Такой логин уже занят. Придумайте другой:")
@@ -447,10 +357,9 @@ class BloodDonorBot:
         password_hash = hashlib.sha256(password.encode()).hexdigest()
         
         data = context.user_data
-        try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
+        user = update.effective_user
+
+        def register(cursor):
             cursor.execute("""
                 INSERT INTO medical_centers (name, address, city, latitude, longitude, login, password_hash)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
@@ -459,20 +368,23 @@ class BloodDonorBot:
                   data.get('reg_mc_latitude'), data.get('reg_mc_longitude'),
                   data['reg_mc_login'], password_hash))
             
-            mc_id = cursor.fetchone()[0]
+            mc_id = cursor.fetchone()['id']
             
             # Ensure user is registered as doctor and linked to MC
-            user = update.effective_user
             cursor.execute("""
                 INSERT INTO users (telegram_id, username, first_name, last_name, role, is_registered, medical_center_id)
                 VALUES (%s, %s, %s, %s, 'doctor', TRUE, %s)
                 ON CONFLICT (telegram_id) 
                 DO UPDATE SET role = 'doctor', is_registered = TRUE, medical_center_id = EXCLUDED.medical_center_id
             """, (user.id, user.username, user.first_name, user.last_name, mc_id))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
+            return mc_id
+
+        try:
+            mc_id = await self.db.run(register)
+            # Логин не остается в user_data, которые сохраняются в bot_persistence
+            data.pop('reg_mc_login', None)
+            self.invalidate_user(user.id)
+            await self.refresh_center(mc_id)
 
             context.user_data['mc_id'] = mc_id
             # Load info for session
@@ -485,6 +397,7 @@ class BloodDonorBot:
             return MC_MENU
         except Exception as e:
             logger.error(f"Registration error: {e}")
+            data.pop('reg_mc_login', None)
             await update.message.reply_text("❌ Ошибка регистрации. Попробуйте снова /start")
             return ConversationHandler.END
 
@@ -496,39 +409,34 @@ class BloodDonorBot:
 
     async def process_mc_login_password(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         password = update.message.text
-        login = context.user_data.get('login_mc_login')
+        # Логин нужен только для этой проверки и не остается в сохраняемых user_data
+        login = context.user_data.pop('login_mc_login', None)
         password_hash = hashlib.sha256(password.encode()).hexdigest()
 
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM medical_centers WHERE login = %s AND password_hash = %s", 
-                       (login, password_hash))
-        mc = cursor.fetchone()
-        cursor.close()
+        # Логин и хеш пароля не попадают в mc_info: user_data сохраняется в bot_persistence
+        mc = await self.db.fetchone("""
+            SELECT id, name, address, city, contact_info FROM medical_centers
+            WHERE login = %s AND password_hash = %s
+        """, (login, password_hash))
         
         if mc:
             context.user_data['mc_id'] = mc['id']
             context.user_data['mc_info'] = mc
             
             # Update user role to doctor and link to MC
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
             user = update.effective_user
-            cursor.execute("""
+            await self.db.execute("""
                 INSERT INTO users (telegram_id, username, first_name, last_name, role, is_registered, medical_center_id)
                 VALUES (%s, %s, %s, %s, 'doctor', TRUE, %s)
                 ON CONFLICT (telegram_id) 
                 DO UPDATE SET role = 'doctor', is_registered = TRUE, medical_center_id = EXCLUDED.medical_center_id
             """, (user.id, user.username, user.first_name, user.last_name, mc['id']))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            self.invalidate_user(user.id)
 
             await update.message.reply_text(f"✅ Вход выполнен: {mc['name']}")
             await self.show_doctor_menu(update, context)
             return MC_MENU
         else:
-            conn.close()
             await update.message.reply_text("❌ Неверный логин или пароль. Попробуйте снова логин:")
             return MC_LOGIN_LOGIN
 
@@ -538,19 +446,13 @@ class BloodDonorBot:
         logger.info(f"Регистрация врача: {user.id}")
 
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.execute("""
+            await self.db.execute("""
                 INSERT INTO users (telegram_id, username, first_name, last_name, role, is_registered)
                 VALUES (%s, %s, %s, %s, 'doctor', TRUE)
                 ON CONFLICT (telegram_id) 
                 DO UPDATE SET role = 'doctor', is_registered = TRUE
             """, (user.id, user.username, user.first_name, user.last_name))
-
-            conn.commit()
-            cursor.close()
-            conn.close()
+            self.invalidate_user(user.id)
 
             await update.message.reply_text("✅ Вы успешно зарегистрированы как врач!")
             await self.show_doctor_menu(update, context)
@@ -631,16 +533,14 @@ class BloodDonorBot:
         # Регистрируем пользователя
         user = update.effective_user
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.execute("""
+            await self.db.execute("""
                 INSERT INTO users (telegram_id, username, first_name, last_name, role, 
-                                 blood_type, location, latitude, longitude, last_donation_date, is_registered)
-                VALUES (%s, %s, %s, %s, 'user', %s, %s, %s, %s, %s, TRUE)
+                                 blood_type, location, city_key, latitude, longitude, last_donation_date, is_registered)
+                VALUES (%s, %s, %s, %s, 'user', %s, %s, %s, %s, %s, %s, TRUE)
                 ON CONFLICT (telegram_id) 
                 DO UPDATE SET blood_type = EXCLUDED.blood_type, 
                              location = EXCLUDED.location, 
+                             city_key = EXCLUDED.city_key,
                              latitude = EXCLUDED.latitude,
                              longitude = EXCLUDED.longitude,
                              last_donation_date = EXCLUDED.last_donation_date,
@@ -648,13 +548,11 @@ class BloodDonorBot:
             """, (user.id, user.username, user.first_name, user.last_name,
                   context.user_data.get('blood_type'), 
                   context.user_data.get('location'),
+                  city_key(context.user_data.get('location')),
                   context.user_data.get('latitude'),
                   context.user_data.get('longitude'),
                   last_donation_date))
-
-            conn.commit()
-            cursor.close()
-            conn.close()
+            self.invalidate_user(user.id)
 
             await update.message.reply_text(
                 "🎉 Регистрация завершена! Вы успешно зарегистрированы как донор крови.\n\n"
@@ -703,8 +601,6 @@ class BloodDonorBot:
         else:
             # Try to restore from DB if logged in as doctor
             user_id = update.effective_user.id
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
             
             # Check if user is linked to an MC (via login or registration)
             # We need to store this link. For now, let's assume we check user role and try to find last MC?
@@ -712,21 +608,18 @@ class BloodDonorBot:
             # If it's missing (restart), we might need to re-login or infer from `users` table if we added `medical_center_id` there.
             
             # Let's use the new column we added to `users` table
-            cursor.execute("""
-                SELECT mc.id, mc.name, mc.address, mc.city, mc.contact_info 
-                FROM users u
-                JOIN medical_centers mc ON u.medical_center_id = mc.id
-                WHERE u.telegram_id = %s
-            """, (user_id,))
+            profile = await self.get_user_profile(user_id)
+            mc = None
+            if profile and profile['medical_center_id']:
+                mc = await self.db.fetchone("""
+                    SELECT id, name, address, city, contact_info 
+                    FROM medical_centers WHERE id = %s
+                """, (profile['medical_center_id'],))
             
-            mc = cursor.fetchone()
             if mc:
                 context.user_data['mc_id'] = mc['id']
                 context.user_data['mc_info'] = mc
                 mc_name = mc['name']
-            
-            cursor.close()
-            conn.close()
 
         keyboard = [
             [InlineKeyboardButton("🚦 Донорский светофор", callback_data="traffic_light")],
@@ -770,8 +663,13 @@ class BloodDonorBot:
             await self.show_user_traffic_light(update, context)
             return USER_MENU
         elif query.data.startswith("rel_req_page_"):
-            page = int(query.data.split("_")[-1])
-            await self.show_relevant_requests(update, context, page=page)
+            # rel_req_page_<page>_<after|before>_<YYYYMMDD>_<id>
+            parts = query.data[len("rel_req_page_"):].split("_")
+            if len(parts) == 4:
+                cursor = (parts[1], datetime.strptime(parts[2], '%Y%m%d').date(), int(parts[3]))
+                await self.show_relevant_requests(update, context, page=int(parts[0]), cursor=cursor)
+            else:
+                await self.show_relevant_requests(update, context)
             return USER_MENU
         elif query.data.startswith("my_req_page_"):
             page = int(query.data.split("_")[-1])
@@ -869,7 +767,7 @@ class BloodDonorBot:
             return CHOOSING_ROLE
         elif query.data == "help":
             await self.show_help(update, context)
-            if self.is_doctor(update.effective_user.id):
+            if await self.is_doctor(update.effective_user.id):
                 return DOCTOR_MENU
             else:
                 return USER_MENU
@@ -882,12 +780,7 @@ class BloodDonorBot:
         elif query.data == "back_to_menu":
             user = update.effective_user
             try:
-                conn = self.get_db_connection()
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (user.id,))
-                user_data = cursor.fetchone()
-                cursor.close()
-                conn.close()
+                user_data = await self.get_user_profile(user.id)
 
                 if user_data and user_data['role'] == 'doctor':
                     await self.show_doctor_menu(update, context)
@@ -907,33 +800,12 @@ class BloodDonorBot:
                 await update.callback_query.answer("Ошибка: МЦ не выбран")
             return MC_MENU
 
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT blood_type, status FROM blood_needs WHERE medical_center_id = %s", (mc_id,))
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        vector = await self.traffic_lights.get(mc_id)
+        await self.render_traffic_light(update, vector)
 
-        # Default statuses if not found
-        status_map = {row['blood_type']: row['status'] for row in rows}
-        blood_types = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
-        
-        # Status emojis
-        emojis = {'ok': '🟢', 'need': '🟡', 'urgent': '🔴'}
-        
-        keyboard = []
-        row = []
-        for bt in blood_types:
-            status = status_map.get(bt, 'ok')
-            btn_text = f"{bt} {emojis[status]}"
-            row.append(InlineKeyboardButton(btn_text, callback_data=f"tl_toggle_{bt}"))
-            if len(row) == 2:
-                keyboard.append(row)
-                row = []
-        
-        keyboard.append([InlineKeyboardButton("🔙 В меню", callback_data="back_to_menu")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+    async def render_traffic_light(self, update: Update, vector):
+        """Показывает светофор по вектору статусов без обращения к БД"""
+        reply_markup = traffic_light_keyboard(vector)
         msg = "🚦 **Донорский светофор**\n\nНажимайте на группу крови, чтобы изменить статус:\n🟢 Достаточно\n🟡 Нужно пополнить\n🔴 Срочно (Агрессивный поиск)"
         
         if update.callback_query:
@@ -955,50 +827,28 @@ class BloodDonorBot:
             mc_id = context.user_data.get('mc_id')
             
             if not mc_id:
-                # Recovery attempt
-                conn = self.get_db_connection()
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                cursor.execute("SELECT id, name FROM medical_centers WHERE doctor_id = %s", (update.effective_user.id,))
-                mc = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                if mc:
-                    context.user_data['mc_id'] = mc['id']
-                    context.user_data['mc_info'] = mc
-                    mc_id = mc['id']
+                # Recovery attempt: the doctor's medical center is kept in the cached profile
+                profile = await self.get_user_profile(update.effective_user.id)
+                mc_id = profile.get('medical_center_id') if profile else None
+                if mc_id:
+                    context.user_data['mc_id'] = mc_id
                 else:
                      await query.edit_message_text("❌ Ошибка сессии. Пожалуйста, перезайдите в меню МЦ.")
                      return DOCTOR_MENU
             
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Get current
-            cursor.execute("SELECT status FROM blood_needs WHERE medical_center_id = %s AND blood_type = %s", 
-                           (mc_id, blood_type))
-            row = cursor.fetchone()
-            
-            current = row['status'] if row else 'ok'
-            # Cycle: ok -> need -> urgent -> ok
-            next_status = {'ok': 'need', 'need': 'urgent', 'urgent': 'ok'}[current]
-            
-            # Upsert
-            cursor.execute("""
-                INSERT INTO blood_needs (medical_center_id, blood_type, status)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (medical_center_id, blood_type) 
-                DO UPDATE SET status = %s
-            """, (mc_id, blood_type, next_status, next_status))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
+            # Cycle ok -> need -> urgent -> ok in a single upsert
+            next_status, vector = await self.traffic_lights.toggle(mc_id, blood_type)
+            if not self.needs_board.knows(mc_id):
+                await self.refresh_center(mc_id)
+            self.needs_board.set_status(mc_id, blood_type, next_status)
+            self.services.notify('need', mc_id=mc_id, blood_type=blood_type, status=next_status)
             
             if next_status == 'urgent':
-                await self.broadcast_need(mc_id, blood_type)
+                # Рассылка идет в фоне, врач сразу видит обновленный светофор
+                context.application.create_task(self.broadcast_need(mc_id, blood_type))
 
             # Refresh view
-            await self.show_traffic_light(update, context)
+            await self.render_traffic_light(update, vector)
             return MANAGE_BLOOD_NEEDS
         return MANAGE_BLOOD_NEEDS
 
@@ -1006,27 +856,17 @@ class BloodDonorBot:
     async def show_cert_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        # Check expiration
-        was_expired = self.check_cert_expiration(user_id)
-        
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT medical_certificate_date FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        # Expired certificates are removed by the background sweep (sweep_certificates)
+        user = await self.get_user_profile(user_id) or {}
         
         cert_date = user.get('medical_certificate_date')
         msg = "📄 **Медицинская справка**\n\n"
         
-        if was_expired:
-             msg += "⚠️ **Ваша предыдущая справка истекла и была удалена.**\nПожалуйста, загрузите новую.\n\n"
-        
-        if cert_date:
-            days_passed = (date.today() - cert_date).days
-            validity = 180 # 6 months
+        if days_valid(cert_date):
             msg += f"✅ Справка активна (загружена {cert_date.strftime('%d.%m.%Y')})\n"
-            msg += f"Действительна еще {validity - days_passed} дней."
+            msg += f"Действительна еще {days_valid(cert_date)} дней."
+        elif cert_date:
+            msg += "⚠️ **Срок действия справки истек.**\nПожалуйста, загрузите новую."
         else:
             msg += "❌ Справка не загружена.\nЗагрузите фото справки, чтобы врачи могли видеть ваш статус."
             
@@ -1047,16 +887,12 @@ class BloodDonorBot:
         file_id = photo.file_id
         user_id = update.effective_user.id
         
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
+        await self.db.execute("""
             UPDATE users 
             SET medical_certificate_file_id = %s, medical_certificate_date = CURRENT_DATE
             WHERE telegram_id = %s
         """, (file_id, user_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        self.invalidate_user(user_id)
         
         await update.message.reply_text("✅ Справка успешно загружена/обновлена!")
         await self.show_user_menu(update, context)
@@ -1070,81 +906,79 @@ class BloodDonorBot:
              return USER_MENU
         return DONOR_CERT_UPLOAD
 
-    def check_cert_expiration(self, user_id):
-        """Проверяет и удаляет просроченную справку"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT medical_certificate_date FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
-        
-        if user and user['medical_certificate_date']:
-            cert_date = user['medical_certificate_date']
-            days_passed = (date.today() - cert_date).days
-            validity = 180 # 6 months
-            
-            if days_passed >= validity:
-                cursor.execute("""
-                    UPDATE users 
-                    SET medical_certificate_file_id = NULL, medical_certificate_date = NULL 
-                    WHERE telegram_id = %s
-                """, (user_id,))
-                conn.commit()
-                cursor.close()
-                conn.close()
-                return True # Expired and deleted
-                
-        cursor.close()
-        conn.close()
-        return False # Valid or not present
+    async def sweep_certificates(self, context: ContextTypes.DEFAULT_TYPE):
+        """Периодическая задача: удаляет просроченные справки и сообщает об этом донорам"""
+        if not self.services.leader.is_leader:
+            return
+        try:
+            # Справки удаляются вместе с постановкой уведомлений в очередь
+            expired = await self.outbox.enqueue_from('certificate', EXPIRED_MESSAGE, expire_certificates)
+        except Exception as e:
+            logger.error(f"Ошибка удаления просроченных справок: {e}")
+            return
+        if not expired:
+            return
+        for user_id in expired:
+            self.invalidate_user(user_id)
+        logger.info(f"Удалено просроченных справок: {len(expired)}")
+
+    async def refresh_statistics(self, context: ContextTypes.DEFAULT_TYPE):
+        """Периодическая задача: пересчитывает статистику пользователей (donor_stats)"""
+        if not self.services.leader.is_leader:
+            return
+        try:
+            await refresh_stats(self.db)
+        except Exception as e:
+            logger.error(f"Ошибка пересчета статистики: {e}")
+
+    async def send_eligibility_reminders(self, context: ContextTypes.DEFAULT_TYPE):
+        """Ежедневная задача: напоминает донорам, что они снова могут сдавать кровь"""
+        if not self.services.leader.is_leader:
+            return
+        try:
+            queued = await queue_reminders(self.db, self.outbox)
+        except Exception as e:
+            logger.error(f"Ошибка постановки напоминаний донорам: {e}")
+            return
+        if queued:
+            logger.info(f"Напоминаний о возможности сдать кровь поставлено в очередь: {queued}")
 
     # --- DONOR SEARCH ---
     async def start_donation_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT blood_type, city, latitude, longitude FROM users WHERE telegram_id = %s", (user_id,))
-        user = cursor.fetchone()
+        user = await self.get_user_profile(user_id)
         
         if not user or not user['blood_type']:
             if update.callback_query:
                 await update.callback_query.answer("Сначала укажите группу крови!")
             return USER_MENU
 
-        # Find MCs with need
-        cursor.execute("""
-            SELECT mc.id, mc.name, mc.address, mc.city, bn.status, mc.latitude, mc.longitude
+        # Find MCs that need any blood type the donor can give to ('urgent' > 'need')
+        mcs_sql = """
+            SELECT mc.id, mc.name, mc.address, mc.city, mc.latitude, mc.longitude, MAX(bn.status) AS status,
+                   ARRAY_AGG(bn.blood_type ORDER BY bn.blood_type) AS blood_types
             FROM blood_needs bn
             JOIN medical_centers mc ON bn.medical_center_id = mc.id
-            WHERE bn.blood_type = %s AND bn.status IN ('need', 'urgent')
-        """, (user['blood_type'],))
-        mcs = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if not mcs:
-            if update.callback_query:
-                await update.callback_query.edit_message_text("😔 К сожалению, сейчас нет запросов на вашу группу крови.")
-            return USER_MENU
-            
-        # Calculate distances and sort
-        user_lat = user['latitude']
-        user_lon = user['longitude']
+            WHERE bn.blood_type = ANY(%s) AND bn.status IN ('need', 'urgent') {condition}
+            GROUP BY mc.id
+        """
+        recipients = recipient_types(user['blood_type'])
+        limit = 10 # Show top 10
         
-        valid_mcs = []
-        for mc in mcs:
-            dist = self.calculate_distance(user_lat, user_lon, mc['latitude'], mc['longitude'])
-            mc['distance'] = dist
-            # Filter by radius (e.g., 50km) if user has coords AND mc has coords
-            if user_lat and mc['latitude']:
-                 if dist <= 50: # 50km radius
-                     valid_mcs.append(mc)
-            else:
-                # If no coords, show all matching by city or just show all?
-                # Let's show all but maybe mark them
-                valid_mcs.append(mc)
-
-        # Sort by distance (None last)
-        valid_mcs.sort(key=lambda x: x['distance'] if x['distance'] is not None else 9999)
+        if user['latitude'] is not None and user['longitude'] is not None:
+            # Nearest within 50km radius (from in-memory index), then centers without coords
+            distances = self.nearby_centers(user['latitude'], user['longitude'], radius_km=50)
+            valid_mcs = await self.db.fetchall(mcs_sql.format(condition="AND mc.id = ANY(%s)"),
+                                               (recipients, list(distances)))
+            for mc in valid_mcs:
+                mc['distance'] = distances[mc['id']]
+            valid_mcs = sorted(valid_mcs, key=lambda mc: mc['distance'])[:limit]
+            if len(valid_mcs) < limit:
+                valid_mcs += await self.db.fetchall(
+                    mcs_sql.format(condition="AND mc.latitude IS NULL") + " LIMIT %s",
+                    (recipients, limit - len(valid_mcs)))
+        else:
+            valid_mcs = await self.db.fetchall(mcs_sql.format(condition="") + " LIMIT %s", (recipients, limit))
         
         if not valid_mcs:
              if update.callback_query:
@@ -1152,13 +986,13 @@ class BloodDonorBot:
                  await update.callback_query.edit_message_text("😔 В радиусе 50км нет запросов на вашу группу крови.", reply_markup=InlineKeyboardMarkup(keyboard))
              return USER_MENU
 
-        msg = f"🔎 Найдены центры, нуждающиеся в {user['blood_type']}:\n\n"
+        msg = f"🔎 Найдены центры, которым подходит ваша кровь ({user['blood_type']}):\n\n"
         keyboard = []
         
-        for mc in valid_mcs[:10]: # Show top 10
+        for mc in valid_mcs:
             icon = "🔴" if mc['status'] == 'urgent' else "🟡"
-            dist_str = f"{mc['distance']:.1f}км" if mc['distance'] is not None else mc['city']
-            btn_text = f"{icon} {mc['name']} ({dist_str})"
+            dist_str = f"{mc['distance']:.1f}км" if mc.get('distance') is not None else mc['city']
+            btn_text = f"{icon} {mc['name']} ({dist_str}, {', '.join(mc['blood_types'])})"
             keyboard.append([InlineKeyboardButton(btn_text, callback_data=f"view_mc_{mc['id']}")])
             
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")])
@@ -1182,12 +1016,7 @@ class BloodDonorBot:
 
         if data.startswith("view_mc_"):
             mc_id = int(data.replace("view_mc_", ""))
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("SELECT * FROM medical_centers WHERE id = %s", (mc_id,))
-            mc = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            mc = await self.db.fetchone("SELECT * FROM medical_centers WHERE id = %s", (mc_id,))
             
             msg = f"🏥 **{mc['name']}**\n"
             msg += f"📍 {mc['address']}\n"
@@ -1204,34 +1033,20 @@ class BloodDonorBot:
             return DONOR_SEARCH_MC
 
         if data.startswith("agree_donate_"):
-            # Check cert expiration first
-            self.check_cert_expiration(update.effective_user.id)
-            
-            # Check last donation date (60 days rule)
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("SELECT last_donation_date FROM users WHERE telegram_id = %s", (update.effective_user.id,))
-            user_data = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            
-            if user_data and user_data['last_donation_date']:
-                days_since = (datetime.now().date() - user_data['last_donation_date']).days
-                if days_since < 60:
-                    days_left = 60 - days_since
-                    await update.callback_query.answer(f"⛔ Вы сможете сдать кровь только через {days_left} дн.", show_alert=True)
-                    return DONOR_SEARCH_MC
+            # Check donation interval (60 days rule)
+            user_data = await self.db.fetchone("SELECT eligible_from FROM users WHERE telegram_id = %s",
+                                               (update.effective_user.id,))
+            
+            wait_days = days_left(user_data['eligible_from']) if user_data else 0
+            if wait_days:
+                await update.callback_query.answer(f"⛔ Вы сможете сдать кровь только через {wait_days} дн.", show_alert=True)
+                return DONOR_SEARCH_MC
 
             mc_id = int(data.replace("agree_donate_", ""))
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
+            await self.db.execute("""
                 INSERT INTO donation_responses (user_id, medical_center_id, status)
                 VALUES (%s, %s, 'pending')
             """, (update.effective_user.id, mc_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
             
             await update.callback_query.edit_message_text("✅ Спасибо! Ваша заявка отправлена врачу. Ждите подтверждения.")
             await self.show_user_menu(update, context)
@@ -1247,10 +1062,7 @@ class BloodDonorBot:
                 await update.callback_query.answer("Ошибка: МЦ не выбран")
             return MC_MENU
 
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute("""
+        responses = await self.db.fetchall("""
             SELECT dr.id, dr.created_at, u.telegram_id, u.first_name, u.last_name, u.username, 
                    u.blood_type, u.medical_certificate_file_id, u.medical_certificate_date
             FROM donation_responses dr
@@ -1259,10 +1071,6 @@ class BloodDonorBot:
             ORDER BY dr.created_at DESC
         """, (mc_id,))
         
-        responses = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
         if not responses:
             msg = "👥 Пока нет новых откликов доноров."
             if update.callback_query:
@@ -1296,18 +1104,13 @@ class BloodDonorBot:
 
         if data.startswith("view_donor_"):
             resp_id = int(data.replace("view_donor_", ""))
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
+            donor = await self.db.fetchone("""
                 SELECT dr.id, u.first_name, u.last_name, u.username, u.blood_type,
                        u.medical_certificate_file_id, u.medical_certificate_date, u.last_donation_date
                 FROM donation_responses dr
                 JOIN users u ON dr.user_id = u.telegram_id
                 WHERE dr.id = %s
             """, (resp_id,))
-            donor = cursor.fetchone()
-            cursor.close()
-            conn.close()
             
             msg = f"👤 **Донор:** {donor['first_name']} {donor['last_name'] or ''}\n"
             msg += f"🩸 Группа: {donor['blood_type']}\n"
@@ -1347,20 +1150,21 @@ class BloodDonorBot:
 
         if data.startswith("confirm_donation_"):
             resp_id = int(data.replace("confirm_donation_", ""))
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            # Update response status
-            cursor.execute("UPDATE donation_responses SET status = 'completed' WHERE id = %s RETURNING user_id", (resp_id,))
-            row = cursor.fetchone()
+
+            def confirm(cursor):
+                # Update response status
+                cursor.execute("UPDATE donation_responses SET status = 'completed' WHERE id = %s RETURNING user_id", (resp_id,))
+                row = cursor.fetchone()
+                if row:
+                    # Update user last donation date
+                    cursor.execute("UPDATE users SET last_donation_date = CURRENT_DATE WHERE telegram_id = %s",
+                                   (row['user_id'],))
+                return row
+
+            row = await self.db.run(confirm)
             if row:
-                user_id = row[0]
-                # Update user last donation date
-                cursor.execute("UPDATE users SET last_donation_date = CURRENT_DATE WHERE telegram_id = %s", (user_id,))
-                conn.commit()
-            
-            cursor.close()
-            conn.close()
+                user_id = row['user_id']
+                self.invalidate_user(user_id)
             
             await update.callback_query.edit_message_text("✅ Донация подтверждена! Таймер донора обновлен.")
             
@@ -1376,22 +1180,17 @@ class BloodDonorBot:
 
         if data.startswith("reject_donation_"):
             resp_id = int(data.replace("reject_donation_", ""))
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
             
             # Update response status
-            cursor.execute("UPDATE donation_responses SET status = 'rejected' WHERE id = %s RETURNING user_id", (resp_id,))
-            row = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
+            row = await self.db.fetchone(
+                "UPDATE donation_responses SET status = 'rejected' WHERE id = %s RETURNING user_id", (resp_id,))
             
             await update.callback_query.edit_message_text("⛔ Заявка отклонена.")
             
             # Notify user
             try:
                 if row:
-                     user_id = row[0]
+                     user_id = row['user_id']
                      await context.bot.send_message(user_id, "😔 Врач отметил, что донация не состоялась.")
             except:
                 pass
@@ -1401,15 +1200,10 @@ class BloodDonorBot:
 
         return MC_MENU
 
-    def is_doctor(self, user_id):
+    async def is_doctor(self, user_id):
         """Проверяет, является ли пользователь врачом"""
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("SELECT role FROM users WHERE telegram_id = %s", (user_id,))
-            user_data = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            user_data = await self.get_user_profile(user_id)
             return user_data and user_data['role'] == 'doctor'
         except:
             return False
@@ -1418,20 +1212,12 @@ class BloodDonorBot:
         """Показывает информацию о пользователе"""
         user = update.effective_user
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-            cursor.execute("SELECT * FROM users WHERE telegram_id = %s", (user.id,))
-            user_data = cursor.fetchone()
+            user_data = await self.db.fetchone("SELECT * FROM users WHERE telegram_id = %s", (user.id,))
 
             if user_data:
                 last_donation = user_data['last_donation_date']
-                if last_donation:
-                    days_since = (datetime.now().date() - last_donation).days
-                    can_donate = days_since >= 60
-                    status = "✅ Можете сдавать кровь" if can_donate else f"⏳ Подождите еще {60 - days_since} дней"
-                else:
-                    status = "✅ Можете сдавать кровь"
+                wait_days = days_left(user_data['eligible_from'])
+                status = f"⏳ Подождите еще {wait_days} дней" if wait_days else "✅ Можете сдавать кровь"
 
                 info_text = f"""
 📊 Ваша информация:
@@ -1448,9 +1234,6 @@ class BloodDonorBot:
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await update.callback_query.edit_message_text(info_text, reply_markup=reply_markup)
-
-            cursor.close()
-            conn.close()
         except Exception as e:
             logger.error(f"Ошибка показа информации пользователя: {e}")
 
@@ -1458,11 +1241,8 @@ class BloodDonorBot:
         """Показывает донации пользователя (New Implementation)"""
         user = update.effective_user
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
             # Fetch from donation_responses linked to medical_centers
-            cursor.execute("""
+            donations = await self.db.fetchall("""
                 SELECT dr.id, dr.status, dr.created_at, mc.name, mc.address, mc.city, mc.contact_info
                 FROM donation_responses dr
                 JOIN medical_centers mc ON dr.medical_center_id = mc.id
@@ -1471,10 +1251,6 @@ class BloodDonorBot:
                 LIMIT 10
             """, (user.id,))
 
-            donations = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
             if donations:
                 text = "🩸 **Мои заявки на донацию**:\n\n"
                 keyboard = []
@@ -1519,22 +1295,17 @@ class BloodDonorBot:
         
         if data.startswith("cancel_app_"):
             app_id = int(data.replace("cancel_app_", ""))
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
             
-            # Check if still pending
-            cursor.execute("SELECT status FROM donation_responses WHERE id = %s AND user_id = %s", (app_id, update.effective_user.id))
-            row = cursor.fetchone()
+            # Cancel only if still pending
+            cancelled = await self.db.execute("""
+                UPDATE donation_responses SET status = 'cancelled'
+                WHERE id = %s AND user_id = %s AND status = 'pending'
+            """, (app_id, update.effective_user.id))
             
-            if row and row[0] == 'pending':
-                cursor.execute("UPDATE donation_responses SET status = 'cancelled' WHERE id = %s", (app_id,))
-                conn.commit()
+            if cancelled:
                 await query.answer("Заявка отменена")
             else:
                 await query.answer("Невозможно отменить (уже обработана)")
-                
-            cursor.close()
-            conn.close()
             
             await self.show_my_donations(update, context)
             return USER_MENU
@@ -1560,25 +1331,19 @@ class BloodDonorBot:
         logger.info(f"Обновление местоположения для пользователя {user.id}: {new_location}")
 
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-
             if latitude and longitude:
-                cursor.execute("""
+                await self.db.execute("""
                     UPDATE users
-                    SET location = %s, latitude = %s, longitude = %s
+                    SET location = %s, city_key = NULL, latitude = %s, longitude = %s
                     WHERE telegram_id = %s
                 """, (new_location, latitude, longitude, user.id))
             else:
-                cursor.execute("""
+                await self.db.execute("""
                     UPDATE users
-                    SET location = %s, latitude = NULL, longitude = NULL
+                    SET location = %s, city_key = %s, latitude = NULL, longitude = NULL
                     WHERE telegram_id = %s
-                """, (new_location, user.id))
-
-            conn.commit()
-            cursor.close()
-            conn.close()
+                """, (new_location, city_key(new_location), user.id))
+            self.invalidate_user(user.id)
 
             await update.message.reply_text("✅ Местоположение успешно обновлено!")
             await self.show_user_menu(update, context)
@@ -1608,18 +1373,12 @@ class BloodDonorBot:
         logger.info(f"Обновление даты сдачи для пользователя {user.id}: {last_donation_date}")
 
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.execute("""
+            await self.db.execute("""
                 UPDATE users
                 SET last_donation_date = %s
                 WHERE telegram_id = %s
             """, (last_donation_date, user.id))
-
-            conn.commit()
-            cursor.close()
-            conn.close()
+            self.invalidate_user(user.id)
 
             await update.message.reply_text("✅ Дата последней сдачи крови успешно обновлена!")
             await self.show_user_menu(update, context)
@@ -1633,50 +1392,24 @@ class BloodDonorBot:
         """Показывает пользователю 'Светофор донора' (потребности МЦ поблизости)"""
         user = update.effective_user
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
             # Get user location
-            cursor.execute("SELECT city, latitude, longitude, blood_type FROM users WHERE telegram_id = %s", (user.id,))
-            user_data = cursor.fetchone()
+            user_data = await self.get_user_profile(user.id)
             
             if not user_data:
                 await update.callback_query.edit_message_text("Ошибка: данные пользователя не найдены.")
-                cursor.close()
-                conn.close()
                 return USER_MENU
 
-            # Fetch all needs
-            cursor.execute("""
-                SELECT bn.blood_type, bn.status, mc.name, mc.city, mc.latitude, mc.longitude 
-                FROM blood_needs bn
-                JOIN medical_centers mc ON bn.medical_center_id = mc.id
-                WHERE bn.status IN ('need', 'urgent')
-            """)
-            needs = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            
+            # Needs within 50km radius, centers without coords are matched by city
+            # (both come from the in-memory needs board, no DB query)
             relevant_needs = []
-            user_lat = user_data['latitude']
-            user_lon = user_data['longitude']
+            has_coords = user_data['latitude'] is not None and user_data['longitude'] is not None
+            if has_coords:
+                relevant_needs = self.needs_board.nearby(user_data['latitude'], user_data['longitude'], radius_km=50)
+            if user_data['city']:
+                relevant_needs += self.needs_board.in_city(user_data['city'], without_coords=has_coords)
             
-            for need in needs:
-                # Filter by radius (50km) or city
-                is_nearby = False
-                dist_str = ""
-                
-                if user_lat and need['latitude']:
-                    dist = self.calculate_distance(user_lat, user_lon, need['latitude'], need['longitude'])
-                    if dist <= 50:
-                        is_nearby = True
-                        dist_str = f" (~{dist:.1f} км)"
-                elif user_data['city'] and need['city'] and user_data['city'].lower() in need['city'].lower():
-                    is_nearby = True
-                
-                if is_nearby:
-                    need['dist_str'] = dist_str
-                    relevant_needs.append(need)
+            for need in relevant_needs:
+                need['dist_str'] = f" (~{need['distance']:.1f} км)" if need.get('distance') is not None else ""
             
             if not relevant_needs:
                 text = "🚦 В вашем регионе сейчас нет острой потребности в крови.\nСпасибо, что остаетесь с нами!"
@@ -1832,10 +1565,8 @@ class BloodDonorBot:
             f"дата {request_date}")
 
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.execute("""
+            # Получаем ID созданного запроса
+            request_id = await self.db.fetchval("""
                 INSERT INTO donation_requests (doctor_id, blood_type, location, address, hospital_name, contact_info, request_date)
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
                 RETURNING id
@@ -1843,25 +1574,10 @@ class BloodDonorBot:
                   context.user_data['request_location'], context.user_data['request_address'],
                   context.user_data['request_hospital'], context.user_data['request_contact'], request_date))
 
-            # Получаем ID созданного запроса
-            request_id = cursor.fetchone()[0]
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-
             logger.info(f"✅ Запрос успешно сохранен в БД с ID {request_id}")
-
-            # Отправляем уведомления всем подходящим донорам
-            await self.notify_donors(
-                context.user_data['request_blood_type'],
-                context.user_data['request_location'],
-                context.user_data['request_address'],
-                context.user_data['request_hospital'],
-                context.user_data['request_contact'],
-                request_date,
-                request_id
-            )
+            # Новый запрос может попасть в списки любых доноров
+            self.relevant_requests_cache.clear()
+            self.services.notify('requests')
 
             await update.message.reply_text(
                 f"✅ Запрос создан!\n\n"
@@ -1871,8 +1587,21 @@ class BloodDonorBot:
                 f"📍 Адрес: {context.user_data['request_address']}\n"
                 f"📞 Контакты: {context.user_data['request_contact']}\n"
                 f"📅 Дата: {request_date.strftime('%d.%m.%Y')}\n\n"
-                f"Уведомления отправлены всем подходящим донорам."
+                f"Уведомления подходящим донорам отправляются в фоне."
             )
+            status_message = await update.message.reply_text("📨 Рассылка уведомлений: подготовка…")
+
+            # Отправляем уведомления всем подходящим донорам, не задерживая ответ врачу
+            context.application.create_task(self.notify_donors(
+                context.user_data['request_blood_type'],
+                context.user_data['request_location'],
+                context.user_data['request_address'],
+                context.user_data['request_hospital'],
+                context.user_data['request_contact'],
+                request_date,
+                request_id,
+                status_message=status_message
+            ))
 
             await self.show_doctor_menu(update, context)
             return DOCTOR_MENU
@@ -1895,18 +1624,12 @@ class BloodDonorBot:
             user = update.effective_user
             
             try:
-                conn = self.get_db_connection()
-                cursor = conn.cursor()
-                
-                cursor.execute("""
+                await self.db.execute("""
                     UPDATE users 
                     SET blood_type = %s 
                     WHERE telegram_id = %s
                 """, (blood_type, user.id))
-                
-                conn.commit()
-                cursor.close()
-                conn.close()
+                self.invalidate_user(user.id)
                 
                 await query.edit_message_text(f"✅ Группа крови успешно обновлена на {blood_type}!")
                 await self.show_user_menu(update, context)
@@ -1918,81 +1641,100 @@ class BloodDonorBot:
         
         return UPDATE_BLOOD_TYPE
 
-    async def show_relevant_requests(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page=0):
-        """Показывает входящие (релевантные) запросы для донора"""
+    async def relevant_request_keys(self, user_id):
+        """
+        Ключи (request_date, id) подходящих донору запросов в порядке показа
+        и расстояния до них {id: км}. Кэшируется на короткое время, чтобы
+        листание страниц не повторяло поиск; None - не указана группа крови
+        """
+        found = self.relevant_requests_cache.get(user_id)
+        if found is not None:
+            return found
+
+        donor_info = await self.get_user_profile(user_id)
+        if not donor_info or not donor_info['blood_type']:
+            return None
+
+        # Requests within 50km radius, the rest are matched by city
+        city_pattern = f"%{donor_info['city']}%" if donor_info['city'] else None
+        if donor_info['latitude'] is not None and donor_info['longitude'] is not None:
+            distance_params = (donor_info['latitude'], donor_info['latitude'], donor_info['longitude'])
+            distance = distance_sql('mc.latitude', 'mc.longitude')
+            radius_sql, radius_params = radius_condition(
+                donor_info['latitude'], donor_info['longitude'], 50, 'mc.latitude', 'mc.longitude')
+            location_sql = f"AND ({radius_sql} OR (mc.latitude IS NULL AND dr.location ILIKE %s))"
+            location_params = radius_params + (city_pattern,)
+        else:
+            distance, distance_params = "NULL", ()
+            if city_pattern:
+                location_sql, location_params = "AND dr.location ILIKE %s", (city_pattern,)
+            else:
+                # No location info from donor - show all matching blood type
+                location_sql, location_params = "", ()
+
+        rows = await self.db.fetchall(f"""
+            SELECT dr.id, dr.request_date, {distance} AS distance
+            FROM donation_requests dr
+            LEFT JOIN medical_centers mc ON dr.medical_center_id = mc.id
+            WHERE dr.blood_type = ANY(%s)
+            AND dr.request_date >= CURRENT_DATE
+            {location_sql}
+            ORDER BY dr.request_date, dr.id
+        """, distance_params + (recipient_types(donor_info['blood_type']),) + location_params)
+
+        found = ([(row['request_date'], row['id']) for row in rows],
+                 {row['id']: row['distance'] for row in rows})
+        self.relevant_requests_cache.set(user_id, found)
+        return found
+
+    async def show_relevant_requests(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page=0, cursor=None):
+        """
+        Показывает входящие (релевантные) запросы для донора. Страницы листаются
+        по ключу (request_date, id): cursor = ('after' | 'before', дата, id)
+        """
         user = update.effective_user
         items_per_page = 5
         
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Get user info for filters
-            cursor.execute("SELECT blood_type, city, latitude, longitude FROM users WHERE telegram_id = %s", (user.id,))
-            donor_info = cursor.fetchone()
-            
-            if not donor_info or not donor_info['blood_type']:
+            found = await self.relevant_request_keys(user.id)
+            if found is None:
                 await update.callback_query.edit_message_text("❌ Сначала заполните информацию о себе (группа крови).")
-                cursor.close()
-                conn.close()
                 return USER_MENU
-
-            # Fetch active requests matching blood type
-            # We fetch more than needed to filter by radius in python if needed, 
-            # or we can try to filter by city in SQL. 
-            # Let's fetch all matching blood type and future date, then filter/paginate.
-            
-            cursor.execute("""
-                SELECT dr.id, dr.blood_type, dr.location, dr.address, dr.hospital_name, 
-                       dr.contact_info, dr.request_date, mc.latitude, mc.longitude
-                FROM donation_requests dr
-                LEFT JOIN medical_centers mc ON dr.medical_center_id = mc.id
-                WHERE dr.blood_type = %s 
-                AND dr.request_date >= CURRENT_DATE
-                ORDER BY dr.request_date ASC
-            """, (donor_info['blood_type'],))
-            
-            all_requests = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            
-            # Filter by radius if coordinates exist
-            filtered_requests = []
-            donor_lat = donor_info['latitude']
-            donor_lon = donor_info['longitude']
-            
-            for req in all_requests:
-                # Distance check (50km)
-                if donor_lat and req['latitude']:
-                     dist = self.calculate_distance(donor_lat, donor_lon, req['latitude'], req['longitude'])
-                     if dist <= 50:
-                         req['distance'] = dist
-                         filtered_requests.append(req)
-                elif donor_info['city'] and req['location'] and donor_info['city'].lower() in req['location'].lower():
-                     # Fallback to city match
-                     req['distance'] = None
-                     filtered_requests.append(req)
-                elif not donor_info['city'] and not donor_lat:
-                     # No location info from donor? Show all matching blood type? 
-                     # Or maybe ask to set location. Let's show all for now but mark as "Distance unknown"
-                     req['distance'] = None
-                     filtered_requests.append(req)
-
-            # Pagination
-            total_items = len(filtered_requests)
-            start_index = page * items_per_page
-            end_index = start_index + items_per_page
-            current_page_items = filtered_requests[start_index:end_index]
+            keys, distances = found
+
+            # Page boundaries by the key of the neighbouring page
+            direction, key_date, key_id = cursor or ('after', None, None)
+            if key_date is None:
+                start = 0
+            elif direction == 'after':
+                start = bisect.bisect_right(keys, (key_date, key_id))
+            else:
+                start = max(0, bisect.bisect_left(keys, (key_date, key_id)) - items_per_page)
+            end = min(start + items_per_page, len(keys))
+            if start == 0:
+                page = 0
+            has_prev, has_next = start > 0, end < len(keys)
+
+            page_ids = [request_id for _, request_id in keys[start:end]]
+            rows = await self.db.fetchall("""
+                SELECT id, blood_type, location, address, hospital_name, contact_info, request_date
+                FROM donation_requests
+                WHERE id = ANY(%s)
+            """, (page_ids,)) if page_ids else []
+            rows_by_id = {row['id']: row for row in rows}
+            current_page_items = [rows_by_id[request_id] for request_id in page_ids if request_id in rows_by_id]
+            for req in current_page_items:
+                req['distance'] = distances.get(req['id'])
             
             if not current_page_items:
-                if page == 0:
+                if cursor is None:
                     text = "📭 Сейчас нет активных запросов для вашей группы крови поблизости."
                     keyboard = [[InlineKeyboardButton("🔙 В меню", callback_data="back_to_menu")]]
                     await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
                     return USER_MENU
                 else:
-                    # Should not happen if logic is correct, but safe fallback
-                    await self.show_relevant_requests(update, context, page=0)
+                    # Requests of the page expired meanwhile - back to the first page
+                    await self.show_relevant_requests(update, context)
                     return USER_MENU
 
             text = f"🔔 **Входящие запросы** (Стр. {page + 1})\n\n"
@@ -2009,12 +1751,17 @@ class BloodDonorBot:
                 # Button to respond to specific request
                 keyboard.append([InlineKeyboardButton(f"✅ Откликнуться: {req['hospital_name']}", callback_data=f"respond_{req['id']}")])
 
-            # Nav buttons
+            # Nav buttons carry the key of the first/last request on the page
+            first, last = current_page_items[0], current_page_items[-1]
             nav_row = []
-            if page > 0:
-                nav_row.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"rel_req_page_{page-1}"))
-            if end_index < total_items:
-                nav_row.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"rel_req_page_{page+1}"))
+            if has_prev:
+                nav_row.append(InlineKeyboardButton(
+                    "⬅️ Назад",
+                    callback_data=f"rel_req_page_{page-1}_before_{first['request_date']:%Y%m%d}_{first['id']}"))
+            if has_next:
+                nav_row.append(InlineKeyboardButton(
+                    "Вперед ➡️",
+                    callback_data=f"rel_req_page_{page+1}_after_{last['request_date']:%Y%m%d}_{last['id']}"))
             
             if nav_row:
                 keyboard.append(nav_row)
@@ -2037,14 +1784,11 @@ class BloodDonorBot:
         offset = page * items_per_page
         
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
             # Count total
-            cursor.execute("SELECT COUNT(*) as count FROM donation_requests WHERE doctor_id = %s", (user.id,))
-            total_count = cursor.fetchone()['count']
+            total_count = await self.db.fetchval(
+                "SELECT COUNT(*) as count FROM donation_requests WHERE doctor_id = %s", (user.id,))
 
-            cursor.execute("""
+            requests = await self.db.fetchall("""
                 SELECT dr.id, dr.doctor_id, dr.blood_type, dr.location, 
                        COALESCE(dr.hospital_name, 'Не указано') as hospital_name,
                        COALESCE(dr.address, 'Адрес не указан') as address,
@@ -2061,10 +1805,6 @@ class BloodDonorBot:
                 LIMIT %s OFFSET %s
             """, (user.id, items_per_page, offset))
 
-            requests = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
             if requests:
                 text = f"📋 **Ваши запросы** (Стр. {page + 1})\n\n"
                 for i, req in enumerate(requests, 1):
@@ -2104,10 +1844,7 @@ class BloodDonorBot:
         """Показывает отклики доноров на запросы врача"""
         user = update.effective_user
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-            cursor.execute("""
+            responses = await self.db.fetchall("""
                 SELECT dr.blood_type, dr.hospital_name, dr.location, dr.request_date,
                        u.first_name, u.last_name, u.username, u.blood_type as donor_blood_type,
                        u.location as donor_location, resp.responded_at, dr.id as request_id
@@ -2119,8 +1856,6 @@ class BloodDonorBot:
                 LIMIT 20
             """, (user.id,))
 
-            responses = cursor.fetchall()
-
             if responses:
                 text = "👥 Отклики доноров на ваши запросы:\n\n"
                 
@@ -2165,9 +1900,6 @@ class BloodDonorBot:
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
-
-            cursor.close()
-            conn.close()
         except Exception as e:
             logger.error(f"Ошибка показа откликов доноров: {e}")
             await update.callback_query.edit_message_text("Произошла ошибка при загрузке откликов.")
@@ -2175,58 +1907,25 @@ class BloodDonorBot:
     async def show_statistics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показывает статистику для врача"""
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-            # Общее количество доноров
-            cursor.execute("SELECT COUNT(*) AS total_donors FROM users WHERE role = 'user' AND is_registered = TRUE")
-            total_donors = cursor.fetchone()['total_donors']
-
-            # Количество доноров по группам крови
-            cursor.execute("""
-                SELECT blood_type, COUNT(*) AS count 
-                FROM users 
-                WHERE role = 'user' AND is_registered = TRUE
-                GROUP BY blood_type
-                ORDER BY blood_type
-            """)
-            blood_type_stats = cursor.fetchall()
-
-            # Количество доноров, которые могут сдавать кровь
-            cursor.execute("""
-                SELECT COUNT(*) AS can_donate_count
-                FROM users
-                WHERE role = 'user' 
-                  AND is_registered = TRUE
-                  AND (last_donation_date IS NULL OR last_donation_date <= %s)
-            """, (datetime.now().date() - timedelta(days=60),))
-            can_donate_count = cursor.fetchone()['can_donate_count']
+            # Counters come from the donor_stats/response_stats views (refreshed by refresh_statistics)
+            summary = await load_stats(self.db)
+            recent_requests, total_responses = await load_recent_requests(self.db)
 
             # Формируем текст статистики
             stats_text = f"📊 Статистика системы:\n\n"
-            stats_text += f"👥 Всего доноров: {total_donors}\n"
-            stats_text += f"🩸 Доноры, готовые сдать кровь: {can_donate_count}\n\n"
+            stats_text += f"👥 Всего доноров: {summary['donors']}\n"
+            stats_text += f"🩸 Доноры, готовые сдать кровь: {summary['eligible']}\n\n"
             stats_text += "📈 Распределение по группам крови:\n"
 
-            for stat in blood_type_stats:
-                stats_text += f"• {stat['blood_type']}: {stat['count']} чел.\n"
+            for stat in summary['by_blood_type']:
+                stats_text += f"• {stat['blood_type'] or 'не указана'}: {stat['donors']} чел.\n"
 
-            stats_text += "\n📋 Последние 5 запросов крови:\n"
+            if summary['top_cities']:
+                stats_text += "\n📍 Больше всего доноров:\n"
+                for city in summary['top_cities']:
+                    stats_text += f"• {city['city']}: {city['donors']} чел.\n"
 
-            # Последние 5 запросов с количеством откликов
-            cursor.execute("""
-                SELECT dr.blood_type, dr.location, 
-                       COALESCE(dr.hospital_name, 'Не указано') as hospital_name,
-                       COALESCE(dr.address, 'Адрес не указан') as address, 
-                       dr.request_date,
-                       COUNT(resp.id) as response_count
-                FROM donation_requests dr
-                LEFT JOIN donor_responses resp ON dr.id = resp.request_id
-                GROUP BY dr.id, dr.blood_type, dr.location, dr.hospital_name, dr.address, dr.request_date, dr.created_at
-                ORDER BY dr.created_at DESC 
-                LIMIT 5
-            """)
-            recent_requests = cursor.fetchall()
+            stats_text += "\n📋 Последние 5 запросов крови:\n"
 
             if recent_requests:
                 for i, req in enumerate(recent_requests, 1):
@@ -2237,58 +1936,25 @@ class BloodDonorBot:
             else:
                 stats_text += "\nПока нет запросов крови."
 
-            # Добавляем общую статистику по откликам
-            cursor.execute("""
-                SELECT COUNT(*) as total_responses
-                FROM donor_responses
-            """)
-            total_responses_result = cursor.fetchone()
-            total_responses = total_responses_result['total_responses'] if total_responses_result else 0
-
             stats_text += f"\n\n📊 Общая статистика откликов: {total_responses}"
 
             keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
             await update.callback_query.edit_message_text(stats_text, reply_markup=reply_markup)
-
-            cursor.close()
-            conn.close()
         except Exception as e:
             logger.error(f"Ошибка показа статистики: {e}")
             await update.callback_query.edit_message_text("Произошла ошибка при загрузке статистики.")
 
-    async def notify_donors(self, blood_type: str, location: str, address: str, hospital_name: str, contact_info: str, request_date, request_id: int):
-        """Отправляет уведомления донорам"""
+    async def notify_donors(self, blood_type: str, location: str, address: str, hospital_name: str, contact_info: str, request_date, request_id: int, status_message=None):
+        """Отправляет уведомления донорам (status_message - сообщение врачу для отображения прогресса)"""
         logger.info(f"Отправка уведомлений донорам группы {blood_type} в {location} ({hospital_name})")
 
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-            # Находим всех подходящих доноров
-            cursor.execute("""
-                SELECT telegram_id, first_name, last_donation_date, location 
-                FROM users 
-                WHERE blood_type = %s AND role = 'user' AND is_registered = TRUE
-            """, (blood_type,))
-
-            donors = cursor.fetchall()
-            logger.info(f"Найдено {len(donors)} доноров группы {blood_type}")
-
-            sent_count = 0
-            for donor in donors:
-                # Проверяем, может ли донор сдавать кровь
-                can_donate = True
-                if donor['last_donation_date']:
-                    days_since = (datetime.now().date() - donor['last_donation_date']).days
-                    can_donate = days_since >= 60
-
-                if can_donate:
-                    message = f"""
+            message = f"""
 🆘 СРОЧНО НУЖНА КРОВЬ!
 
-🩸 Группа крови: {blood_type}
+🩸 Группа крови: {blood_type} (подходит ваша)
 📍 Город: {location}
 🏥 Медицинский центр: {hospital_name}
 📍 Адрес: {address}
@@ -2296,30 +1962,43 @@ class BloodDonorBot:
 📞 Контакты: {contact_info}
 
 Если вы готовы сдать кровь, нажмите кнопку ниже, чтобы откликнуться.
-                    """
-                    
-                    keyboard = [
-                        [InlineKeyboardButton("✅ Я готов сдать!", callback_data=f"respond_{request_id}")],
-                        [InlineKeyboardButton("❌ Не могу", callback_data="ignore_request")]
-                    ]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    
-                    try:
-                        await self.application.bot.send_message(
-                            chat_id=donor['telegram_id'],
-                            text=message,
-                            reply_markup=reply_markup
-                        )
-                        sent_count += 1
-                    except Exception as e:
-                        logger.error(f"Не удалось отправить сообщение донору {donor['telegram_id']}: {e}")
-                        logger.error(f"Ошибка отправки уведомления донору {donor['telegram_id']}: {e}")
-
-            logger.info(f"Отправлено {sent_count} уведомлений из {len(donors)} возможных доноров")
-            cursor.close()
-            conn.close()
+            """
+            
+            keyboard = [
+                [InlineKeyboardButton("✅ Я готов сдать!", callback_data=f"respond_{request_id}")],
+                [InlineKeyboardButton("❌ Не могу", callback_data="ignore_request")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+
+            broadcast_id = await self.outbox.create_broadcast(
+                'request', message,
+                dedup_key=f"request:{request_id}",
+                reply_markup=reply_markup,
+                status_message=status_message,
+            )
+            if broadcast_id is None:
+                logger.info(f"Уведомления по запросу {request_id} уже поставлены в очередь")
+                return 0
+
+            # Доноры совместимых групп (прошло не меньше 60 дней с последней сдачи)
+            # читаются порциями серверным курсором и сразу уходят в очередь
+            donors_types = donor_types(blood_type)
+            queued = 0
+            async for donors in self.db.stream(f"""
+                SELECT telegram_id
+                FROM users
+                WHERE blood_type = ANY(%s) AND role = 'user' AND is_registered = TRUE
+                AND {ELIGIBLE_SQL}
+            """, (donors_types,), chunk_size=1000):
+                queued += await self.outbox.add_recipients(broadcast_id, [d['telegram_id'] for d in donors])
+            await self.outbox.complete_recipients(broadcast_id)
+
+            logger.info(f"В очередь поставлено {queued} уведомлений донорам групп {', '.join(donors_types)}")
+            return queued
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомлений: {e}")
+            if status_message:
+                await status_message.edit_text("❌ Рассылка уведомлений прервана из-за ошибки.")
 
     async def handle_donor_response(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка отклика донора на запрос крови"""
@@ -2332,32 +2011,13 @@ class BloodDonorBot:
         
         logger.info(f"Донор {donor_id} откликается на запрос {request_id}")
         
-        try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # 1. Fetch request info (date) and donor info (last donation) to check 60-day rule
+        def load_dates(cursor):
             cursor.execute("SELECT request_date FROM donation_requests WHERE id = %s", (request_id,))
             req = cursor.fetchone()
-            if not req:
-                 await query.edit_message_text("❌ Запрос не найден.")
-                 cursor.close()
-                 conn.close()
-                 return
-            request_date = req['request_date']
-
-            cursor.execute("SELECT last_donation_date FROM users WHERE telegram_id = %s", (donor_id,))
-            donor_data = cursor.fetchone()
-            
-            if donor_data and donor_data['last_donation_date']:
-                min_allowed_date = donor_data['last_donation_date'] + timedelta(days=60)
-                if request_date < min_allowed_date:
-                     days_left = (min_allowed_date - request_date).days
-                     await query.answer(f"⛔ Дата запроса слишком ранняя! Вам нужно ждать до {min_allowed_date.strftime('%d.%m.%Y')}.", show_alert=True)
-                     cursor.close()
-                     conn.close()
-                     return
+            cursor.execute("SELECT eligible_from FROM users WHERE telegram_id = %s", (donor_id,))
+            return req, cursor.fetchone()
 
+        def save_response(cursor):
             # Проверяем, не откликался ли донор уже на этот запрос
             cursor.execute("""
                 SELECT id FROM donor_responses 
@@ -2365,13 +2025,7 @@ class BloodDonorBot:
             """, (request_id, donor_id))
             
             if cursor.fetchone():
-                await query.edit_message_text(
-                    "ℹ️ Вы уже откликались на этот запрос.\n\n"
-                    "Спасибо за вашу готовность помочь! ❤️"
-                )
-                cursor.close()
-                conn.close()
-                return
+                return True, None, None
             
             # Сохраняем отклик в базу данных
             cursor.execute("""
@@ -2397,11 +2051,28 @@ class BloodDonorBot:
                 FROM users WHERE telegram_id = %s
             """, (donor_id,))
             
-            donor_info = cursor.fetchone()
+            return False, request_info, cursor.fetchone()
+
+        try:
+            # 1. Fetch request info (date) and donor info (last donation) to check 60-day rule
+            req, donor_data = await self.db.run(load_dates)
+            if not req:
+                 await query.edit_message_text("❌ Запрос не найден.")
+                 return
+            request_date = req['request_date']
+            
+            if donor_data and days_left(donor_data['eligible_from'], request_date):
+                 await query.answer(f"⛔ Дата запроса слишком ранняя! Вам нужно ждать до {donor_data['eligible_from'].strftime('%d.%m.%Y')}.", show_alert=True)
+                 return
+
+            already_responded, request_info, donor_info = await self.db.run(save_response)
             
-            conn.commit()
-            cursor.close()
-            conn.close()
+            if already_responded:
+                await query.edit_message_text(
+                    "ℹ️ Вы уже откликались на этот запрос.\n\n"
+                    "Спасибо за вашу готовность помочь! ❤️"
+                )
+                return
             
             # Убираем кнопку отклика и показываем подтверждение
             await query.edit_message_text(
@@ -2468,14 +2139,9 @@ class BloodDonorBot:
         """Уведомляет врача о новом отклике донора"""
         try:
             # Подсчитываем общее количество откликов на этот запрос
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
+            total_responses = await self.db.fetchval("""
                 SELECT COUNT(*) FROM donor_responses WHERE request_id = %s
             """, (request_id,))
-            total_responses = cursor.fetchone()[0]
-            cursor.close()
-            conn.close()
             
             donor_name = donor_info['first_name']
             if donor_info['last_name']:
@@ -2513,7 +2179,7 @@ class BloodDonorBot:
 
     async def show_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показывает справку"""
-        help_text = """
+        help_text = f"""
 ❓ Справка по BloodDonorBot
 
 👤 Для доноров:
@@ -2527,7 +2193,7 @@ class BloodDonorBot:
 • Просматривайте статистику по системе
 
 📋 Правила сдачи крови:
-• Минимальный интервал между сдачами: 60 дней
+• Минимальный интервал между сдачами: {DONATION_INTERVAL_DAYS} дней
 • Следуйте рекомендациям врачей
 • Поддерживайте здоровый образ жизни
 
@@ -2542,12 +2208,7 @@ class BloodDonorBot:
     # --- EDIT MC INFO ---
     async def show_edit_mc_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         mc_id = context.user_data.get('mc_id')
-        conn = self.get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT name, address, city, contact_info FROM medical_centers WHERE id = %s", (mc_id,))
-        mc = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        mc = await self.db.fetchone("SELECT name, address, city, contact_info FROM medical_centers WHERE id = %s", (mc_id,))
         
         msg = f"🏥 **Редактирование Медицинского Центра**\n\n"
         msg += f"Название: {mc['name']}\n"
@@ -2595,13 +2256,9 @@ class BloodDonorBot:
         mc_id = context.user_data.get('mc_id')
         
         if field and mc_id:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
             query = f"UPDATE medical_centers SET {field} = %s WHERE id = %s"
-            cursor.execute(query, (new_value, mc_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
+            await self.db.execute(query, (new_value, mc_id))
+            await self.refresh_center(mc_id)
             
             await update.message.reply_text("✅ Информация обновлена!")
             # Update session info
@@ -2615,49 +2272,106 @@ class BloodDonorBot:
         return MC_MENU
 
     async def broadcast_need(self, mc_id, blood_type):
-        try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
+        donors_types = donor_types(blood_type)
+
+        def find_recipients(cursor):
             # Get MC info
             cursor.execute("SELECT name, city FROM medical_centers WHERE id = %s", (mc_id,))
             mc = cursor.fetchone()
             
-            # Find users
-            cursor.execute("""
+            # Find users: exact city key (index), then keys containing it
+            users_sql = f"""
                 SELECT telegram_id, first_name 
                 FROM users 
                 WHERE role = 'user' 
-                AND blood_type = %s 
-                AND (city = %s OR location ILIKE %s)
-                AND (last_donation_date IS NULL OR last_donation_date < CURRENT_DATE - INTERVAL '60 days')
-            """, (blood_type, mc['city'], f"%{mc['city']}%"))
-            
+                AND is_registered = TRUE
+                AND blood_type = ANY(%s)
+                AND {{city_condition}}
+                AND {ELIGIBLE_SQL}
+            """
+            key = city_key(mc['city'])
+            if not key:
+                return mc, []
+            cursor.execute(users_sql.format(city_condition="city_key = %s"), (donors_types, key))
             users = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            
-            count = 0
-            for user in users:
-                try:
-                    await self.application.bot.send_message(
-                        chat_id=user['telegram_id'],
-                        text=f"🚨 **СРОЧНО НУЖНА КРОВЬ!**\n\n"
-                             f"Центр: {mc['name']} ({mc['city']})\n"
-                             f"Группа: {blood_type}\n\n"
-                             f"Пожалуйста, если вы можете сдать кровь, откликнитесь через меню 'Хочу сдать кровь'!",
-                        parse_mode='Markdown'
-                    )
-                    count += 1
-                except Exception as e:
-                    logger.error(f"Failed to send broadcast to {user['telegram_id']}: {e}")
+            if not users:
+                cursor.execute(users_sql.format(city_condition="city_key LIKE %s"), (donors_types, f"%{key}%"))
+                users = cursor.fetchall()
+            return mc, users
+
+        try:
+            mc, users = await self.db.run(find_recipients)
+            
+            # Один и тот же статус за день не рассылается повторно
+            await self.outbox.enqueue(
+                'need',
+                f"🚨 **СРОЧНО НУЖНА КРОВЬ!**\n\n"
+                f"Центр: {mc['name']} ({mc['city']})\n"
+                f"Группа: {blood_type} (подходит ваша)\n\n"
+                f"Пожалуйста, если вы можете сдать кровь, откликнитесь через меню 'Хочу сдать кровь'!",
+                [user['telegram_id'] for user in users],
+                dedup_key=f"need:{mc_id}:{blood_type}:{datetime.now().date()}",
+                parse_mode='Markdown',
+            )
             
-            logger.info(f"Broadcast sent to {count} donors")
-            return count
+            logger.info(f"Broadcast queued for {len(users)} donors")
+            return len(users)
         except Exception as e:
             logger.error(f"Broadcast error: {e}")
             return 0
 
+    async def post_init(self, application: Application):
+        """Создает общие сервисы после инициализации бота"""
+        self.broadcaster = Broadcaster(
+            application.bot,
+            rate=float(os.getenv('BROADCAST_RATE', '25')),
+            concurrency=int(os.getenv('BROADCAST_CONCURRENCY', '20')),
+        )
+        self.outbox = Outbox(
+            self.db,
+            self.broadcaster,
+            batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', '100')),
+            max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5')),
+        )
+        self.outbox.start(application)
+        await self.load_centers_index()
+        await self.load_needs_board()
+        self.services.subscribe('center', lambda data: self.refresh_center(data['id'], notify=False))
+        self.services.subscribe('need', self.apply_need_change)
+        self.services.subscribe('reset', self.reload_shared_state)
+        self.services.start()
+        if application.job_queue is None:
+            logger.warning("JobQueue недоступна (нужен python-telegram-bot[job-queue]), "
+                           "просроченные справки не будут удаляться, статистика не будет обновляться, "
+                           "напоминания донорам не будут отправляться")
+        else:
+            application.job_queue.run_repeating(
+                self.sweep_certificates,
+                interval=float(os.getenv('CERT_SWEEP_INTERVAL', '3600')),
+                first=60,
+                name='sweep_certificates',
+            )
+            application.job_queue.run_repeating(
+                self.refresh_statistics,
+                interval=float(os.getenv('STATS_REFRESH_INTERVAL', '300')),
+                first=10,
+                name='refresh_statistics',
+            )
+            application.job_queue.run_daily(
+                self.send_eligibility_reminders,
+                time=datetime.strptime(os.getenv('REMINDER_TIME', '10:00'), '%H:%M').time(),
+                name='eligibility_reminders',
+            )
+
+    async def post_shutdown(self, application: Application):
+        """Освобождает ресурсы после остановки бота"""
+        if self.outbox:
+            await self.outbox.stop()
+        await self.services.stop()
+        logger.info(f"Время запросов к БД по обработчикам: {self.db.stats()}")
+        logger.info(f"Кэш профилей пользователей: {self.user_cache.stats()}")
+        self.services.close()
+
     def run(self):
         """Запуск бота"""
         # Создаем приложение
@@ -2666,7 +2380,31 @@ class BloodDonorBot:
             logger.error("Токен Telegram не найден! Убедитесь, что он указан в .env файле.")
             return
 
-        self.application = Application.builder().token(token).build()
+        # Состояния диалогов переживают перезапуск, запись в БД пакетами
+        self.persistence = PostgresPersistence(
+            self.db,
+            update_interval=float(os.getenv('PERSISTENCE_INTERVAL', '10')),
+            notify=self.services.notify,
+        )
+        # Состояние чата, который обслуживала другая реплика, перечитывается из базы
+        self.services.subscribe('persistence', self.persistence.invalidate)
+        self.services.subscribe('reset', self.persistence.invalidate_all)
+
+        webhook_mode = os.getenv('BOT_MODE', 'polling') == 'webhook'
+        builder = Application.builder().token(token) \
+            .persistence(self.persistence) \
+            .post_init(self.post_init) \
+            .post_shutdown(self.post_shutdown)
+        # Свой адрес Bot API, например заглушка для локальной проверки (stub_telegram.py)
+        api_url = os.getenv('TELEGRAM_API_URL')
+        if api_url:
+            builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+        # Разные чаты обрабатываются параллельно, один чат - по порядку.
+        # В режиме webhook число необработанных обновлений ограничено: сверх него ответ 503
+        max_pending = int(os.getenv('UPDATE_QUEUE_SIZE', '1000')) if webhook_mode else None
+        builder = builder.concurrent_updates(
+            ChatOrderedUpdateProcessor(int(os.getenv('UPDATE_CONCURRENCY', '32')), max_pending=max_pending))
+        self.application = builder.build()
 
         # Создаем ConversationHandler
         conv_handler = ConversationHandler(
@@ -2722,15 +2460,38 @@ class BloodDonorBot:
                 UPDATE_DONATION_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.update_donation_date)],
                 UPDATE_BLOOD_TYPE: [CallbackQueryHandler(self.process_update_blood_type)]
             },
-            fallbacks=[CommandHandler('start', self.start)]
+            fallbacks=[CommandHandler('start', self.start)],
+            name='main_conversation',
+            persistent=True
         )
 
         self.application.add_handler(conv_handler)
+        self.persistence.track_conversation(conv_handler)
+        self.application.add_handler(TypeHandler(Update, self.persistence.refresh_conversations), group=-1)
+
+        if webhook_mode:
+            self.run_webhook()
+            return
 
         logger.info("Бот запущен")
         # Запускаем бота
         self.application.run_polling()
 
+    def run_webhook(self):
+        """Прием обновлений через webhook (BOT_MODE=webhook)"""
+        from webhook import WebhookServer, serve
+
+        server = WebhookServer(
+            self.application,
+            listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.getenv('WEBHOOK_PORT', '8080')),
+            path=os.getenv('WEBHOOK_PATH', '/telegram'),
+            secret_token=os.getenv('WEBHOOK_SECRET') or None,
+        )
+        logger.info("Бот запущен в режиме webhook")
+        # WEBHOOK_URL задают на одной реплике: она регистрирует адрес в Telegram
+        asyncio.run(serve(self.application, server, webhook_url=os.getenv('WEBHOOK_URL') or None))
+
 
 if __name__ == '__main__':
     bot = BloodDonorBot()
@@ -0,0 +1,123 @@
+"""
+Массовые рассылки с ограничением скорости под лимиты Telegram
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Асинхронный token bucket: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов (например, после RetryAfter)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastResult:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+
+    @property
+    def processed(self):
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def done(self):
+        return self.processed >= self.total
+
+
+class Broadcaster:
+    """
+    Отправляет сообщения параллельно (не больше concurrency одновременно),
+    соблюдая глобальный лимит Telegram (~30 сообщений/с) и лимит на чат,
+    и повторяет отправку после RetryAfter и сетевых ошибок
+    """
+
+    def __init__(self, bot, rate=30, per_chat_interval=1.0, concurrency=20, max_retries=3):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chat_next_send = {}
+
+    async def send(self, chat_id, text, **kwargs):
+        """
+        Отправляет одно сообщение с учетом лимитов. Возвращает (статус, ошибка), где статус:
+        'sent', 'blocked' (бот заблокирован/чат не найден), 'failed' (повторять бессмысленно)
+        или 'retry' (временная ошибка, можно повторить позже)
+        """
+        async with self._semaphore:
+            error = None
+            for attempt in range(self.max_retries + 1):
+                await self._wait_chat(chat_id)
+                await self.bucket.acquire()
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    return 'sent', None
+                except RetryAfter as e:
+                    retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') \
+                        else float(e.retry_after)
+                    logger.warning(f"Telegram просит подождать {retry_after} с, рассылка приостановлена")
+                    self.bucket.pause(retry_after)
+                    error = str(e)
+                except Forbidden as e:
+                    return 'blocked', str(e)
+                except BadRequest as e:
+                    if 'chat not found' in str(e).lower():
+                        return 'blocked', str(e)
+                    logger.error(f"Не удалось отправить сообщение {chat_id}: {e}")
+                    return 'failed', str(e)
+                except (TimedOut, NetworkError) as e:
+                    error = str(e)
+                    if attempt < self.max_retries:
+                        await asyncio.sleep(2 ** attempt)
+                except Exception as e:
+                    logger.error(f"Не удалось отправить сообщение {chat_id}: {e}")
+                    return 'retry', str(e)
+            logger.error(f"Не удалось отправить сообщение {chat_id}: {error}")
+            return 'retry', error
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        next_send = self._chat_next_send.get(chat_id, 0.0)
+        self._chat_next_send[chat_id] = max(now, next_send) + self.per_chat_interval
+        if next_send > now:
+            await asyncio.sleep(next_send - now)
+        if len(self._chat_next_send) > 10000:
+            # Забываем чаты, для которых интервал уже истек
+            self._chat_next_send = {c: t for c, t in self._chat_next_send.items() if t > now}
@@ -0,0 +1,33 @@
+"""
+Срок действия медицинских справок доноров. Просроченные справки удаляет
+фоновая задача одним UPDATE по индексу на medical_certificate_date
+в одной транзакции с постановкой уведомлений в очередь (outbox),
+обработчики донора сами срок не проверяют и в базу ради этого не ходят
+"""
+
+from datetime import date
+
+CERTIFICATE_VALIDITY_DAYS = 180  # 6 месяцев
+
+EXPIRED_MESSAGE = (
+    "⚠️ Срок действия вашей медицинской справки истек, и она была удалена.\n"
+    "Пожалуйста, загрузите новую справку в меню «Справка»."
+)
+
+
+def days_valid(cert_date, on_date=None):
+    """Сколько дней справка еще действительна (0 - просрочена или не загружена)"""
+    if cert_date is None:
+        return 0
+    return max(0, CERTIFICATE_VALIDITY_DAYS - ((on_date or date.today()) - cert_date).days)
+
+
+def expire_certificates(cursor):
+    """Удаляет все просроченные справки, возвращает telegram_id их владельцев"""
+    cursor.execute("""
+        UPDATE users
+        SET medical_certificate_file_id = NULL, medical_certificate_date = NULL
+        WHERE medical_certificate_date <= CURRENT_DATE - %s
+        RETURNING telegram_id
+    """, (CERTIFICATE_VALIDITY_DAYS,))
+    return [row['telegram_id'] for row in cursor.fetchall()]
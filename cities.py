@@ -0,0 +1,36 @@
+"""
+Нормализация названий городов для поиска по индексу: один ключ для
+"Минск", "г. Минск", " МИНСК, ул. Ленина" и "Minsk"
+"""
+
+import re
+
+# Кириллица -> латиница (упрощенная транслитерация, как в загранпаспортах)
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'iu',
+    'я': 'ia', 'і': 'i', 'ў': 'u',
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+
+# "г. Минск", "город Минск", "city of Minsk"
+_PREFIX = re.compile(r'^(?:г\.|гор\.|город\s|city of\s|city\s)\s*', re.IGNORECASE)
+_NOT_LETTERS = re.compile(r'[^a-z0-9]+')
+
+# Так сохраняется местоположение, отправленное геопозицией
+COORDINATES_PREFIX = 'Координаты:'
+
+
+def city_key(text):
+    """
+    Ключ города из свободного текста местоположения: первая часть до запятой
+    без приставки "г.", в нижнем регистре и латиницей. None, если города нет
+    (пустой текст или координаты).
+    """
+    if not text or text.startswith(COORDINATES_PREFIX):
+        return None
+    city = _PREFIX.sub('', text.split(',')[0].strip())
+    key = _NOT_LETTERS.sub('', city.casefold().translate(_TRANSLIT_TABLE))
+    return key[:100] or None
@@ -0,0 +1,193 @@
+"""
+Работа нескольких реплик бота с одной базой: оповещения между репликами
+через LISTEN/NOTIFY (сброс кэшей после записи на другой реплике) и выбор
+ведущей реплики для фоновых задач, которые должны выполняться в одном
+экземпляре (advisory lock на отдельном соединении)
+"""
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import uuid
+import zlib
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = 'bot_events'
+# Параметры TCP keepalive, чтобы оборванное соединение обнаруживалось быстро
+_KEEPALIVE = {'keepalives': 1, 'keepalives_idle': 10, 'keepalives_interval': 5, 'keepalives_count': 3}
+
+
+def _connect(db_config):
+    conn = psycopg2.connect(**db_config, **_KEEPALIVE)
+    conn.autocommit = True
+    return conn
+
+
+def _close_quietly(conn):
+    if conn is not None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+class ReplicaEvents:
+    """
+    Оповещения между репликами. publish() отправляет событие через pg_notify,
+    поток-слушатель получает события других реплик и вызывает обработчики
+    в event loop. После переподключения (события могли потеряться)
+    вызываются обработчики события 'reset'.
+    """
+
+    def __init__(self, db_config, db, channel=EVENTS_CHANNEL, reconnect_delay=5.0):
+        self.db_config = db_config
+        self.db = db
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.replica_id = uuid.uuid4().hex[:12]
+        self._handlers = {}  # kind -> [callback]
+        self._loop = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._tasks = set()
+
+    def subscribe(self, kind, callback):
+        """callback(data) - обычная функция или корутина"""
+        self._handlers.setdefault(kind, []).append(callback)
+
+    def publish(self, kind, **data):
+        """Отправляет событие остальным репликам (в фоне, из event loop)"""
+        payload = json.dumps({'replica': self.replica_id, 'kind': kind, 'data': data})
+        task = asyncio.get_running_loop().create_task(
+            self.db.execute("SELECT pg_notify(%s, %s)", (self.channel, payload), label='replica_events'))
+        self._tasks.add(task)
+        task.add_done_callback(self._publish_done)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name='replica-events', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _publish_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Не удалось отправить событие репликам: {task.exception()}")
+
+    def _handler_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Ошибка обработки события реплики: {task.exception()}")
+
+    def _listen(self):
+        conn = None
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = _connect(self.db_config)
+                    conn.cursor().execute(f"LISTEN {self.channel}")
+                    if connected_before:
+                        self._loop.call_soon_threadsafe(self._dispatch, 'reset', {})
+                    connected_before = True
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._receive(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError) as e:
+                logger.warning(f"Соединение для событий реплик потеряно: {e}")
+                _close_quietly(conn)
+                conn = None
+                self._stop.wait(self.reconnect_delay)
+        _close_quietly(conn)
+
+    def _receive(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if event.get('replica') == self.replica_id:
+            return
+        self._loop.call_soon_threadsafe(self._dispatch, event.get('kind'), event.get('data') or {})
+
+    def _dispatch(self, kind, data):
+        for callback in self._handlers.get(kind, ()):
+            try:
+                result = callback(data)
+                if asyncio.iscoroutine(result):
+                    task = self._loop.create_task(result)
+                    self._tasks.add(task)
+                    task.add_done_callback(self._handler_done)
+            except Exception as e:
+                logger.error(f"Ошибка обработки события {kind}: {e}")
+
+
+class LeaderElection:
+    """
+    Выбор ведущей реплики: ведущая держит pg_advisory_lock на своем
+    соединении. Если реплика падает или теряет соединение, блокировка
+    освобождается и ее забирает другая реплика при следующей попытке
+    (раз в interval секунд)
+    """
+
+    def __init__(self, db_config, name='singleton_jobs', interval=15.0):
+        self.db_config = db_config
+        self.name = name
+        self.interval = interval
+        self.lock_key = zlib.crc32(name.encode())
+        self.is_leader = False
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f'leader-{self.name}', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._conn is None:
+                    self._conn = _connect(self.db_config)
+                cursor = self._conn.cursor()
+                if self.is_leader:
+                    # Блокировка живет, пока живо соединение
+                    cursor.execute("SELECT 1")
+                else:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_key,))
+                    if cursor.fetchone()[0]:
+                        self.is_leader = True
+                        logger.info(f"Реплика стала ведущей для {self.name}")
+            except psycopg2.Error as e:
+                if self.is_leader:
+                    logger.warning(f"Реплика перестала быть ведущей для {self.name}: {e}")
+                self.is_leader = False
+                _close_quietly(self._conn)
+                self._conn = None
+            self._stop.wait(self.interval)
+
+        self.is_leader = False
+        # Закрытие соединения освобождает блокировку
+        _close_quietly(self._conn)
+        self._conn = None
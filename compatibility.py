@@ -0,0 +1,47 @@
+"""
+Совместимость групп крови донора и реципиента (по системе AB0 и резусу).
+Матрица посчитана один раз при импорте как битовые маски в порядке
+BLOOD_TYPES: кто может сдать кровь для группы и кому может сдать донор.
+В запросах маски разворачиваются в список групп для blood_type = ANY(%s) -
+один поиск по индексу вместо отдельного поиска на каждую группу
+"""
+
+from traffic_light import BLOOD_TYPES
+
+BITS = {bt: 1 << i for i, bt in enumerate(BLOOD_TYPES)}
+
+
+def _compatible(donor, recipient):
+    # Антигены A/B донора должны быть у реципиента; резус-отрицательную
+    # кровь можно всем, резус-положительную - только резус-положительным
+    donor_antigens = set(donor[:-1].replace('O', ''))
+    recipient_antigens = set(recipient[:-1].replace('O', ''))
+    return donor_antigens <= recipient_antigens and (donor[-1] == '-' or recipient[-1] == '+')
+
+
+# Реципиент -> маска групп доноров, донор -> маска групп реципиентов
+DONORS_MASK = {r: sum(BITS[d] for d in BLOOD_TYPES if _compatible(d, r)) for r in BLOOD_TYPES}
+RECIPIENTS_MASK = {d: sum(BITS[r] for r in BLOOD_TYPES if _compatible(d, r)) for d in BLOOD_TYPES}
+
+
+def types_in(mask):
+    """Группы крови, биты которых установлены в маске"""
+    return [bt for bt in BLOOD_TYPES if mask & BITS[bt]]
+
+
+_DONOR_TYPES = {bt: types_in(mask) for bt, mask in DONORS_MASK.items()}
+_RECIPIENT_TYPES = {bt: types_in(mask) for bt, mask in RECIPIENTS_MASK.items()}
+
+
+def can_donate(donor, recipient):
+    return bool(RECIPIENTS_MASK.get(donor, 0) & BITS.get(recipient, 0))
+
+
+def donor_types(recipient):
+    """Группы доноров, которые подходят реципиенту; неизвестная группа - только она сама"""
+    return list(_DONOR_TYPES.get(recipient, [recipient]))
+
+
+def recipient_types(donor):
+    """Группы реципиентов, которым может сдать кровь донор"""
+    return list(_RECIPIENT_TYPES.get(donor, [donor]))
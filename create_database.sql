@@ -41,9 +41,12 @@ CREATE TABLE users (
     role VARCHAR(20) NOT NULL CHECK (role IN ('user', 'doctor')),
     blood_type VARCHAR(10),
     city VARCHAR(100),
+    city_key VARCHAR(100),
     latitude FLOAT,
     longitude FLOAT,
     last_donation_date DATE,
+    eligible_from DATE GENERATED ALWAYS AS (last_donation_date + 60) STORED, -- можно снова сдавать кровь
+    eligibility_reminded_for DATE, -- для какой eligible_from отправлено напоминание
     medical_certificate_file_id VARCHAR(255),
     medical_certificate_date DATE,
     is_registered BOOLEAN DEFAULT FALSE,
@@ -72,15 +75,103 @@ CREATE TABLE donation_responses (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Отклики доноров на запросы крови
+CREATE TABLE donor_responses (
+    id SERIAL PRIMARY KEY,
+    request_id INTEGER NOT NULL REFERENCES donation_requests(id) ON DELETE CASCADE,
+    donor_id BIGINT NOT NULL,
+    response_type VARCHAR(20) NOT NULL DEFAULT 'interested',
+    responded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (request_id, donor_id)
+);
+
+-- Рассылки уведомлений донорам
+CREATE TABLE broadcasts (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(30) NOT NULL, -- request, need
+    dedup_key VARCHAR(100) UNIQUE, -- защита от повторной рассылки того же запроса
+    text TEXT NOT NULL,
+    reply_markup JSONB,
+    parse_mode VARCHAR(20),
+    status_chat_id BIGINT, -- сообщение врачу с прогрессом рассылки
+    status_message_id BIGINT,
+    total INTEGER NOT NULL DEFAULT 0, -- счетчики получателей по статусам
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    recipients_complete BOOLEAN NOT NULL DEFAULT FALSE, -- все получатели поставлены в очередь
+    completed_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Очередь исходящих уведомлений (по строке на получателя)
+CREATE TABLE notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    broadcast_id INTEGER NOT NULL REFERENCES broadcasts(id) ON DELETE CASCADE,
+    chat_id BIGINT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed', 'blocked')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (broadcast_id, chat_id)
+);
+
+-- Состояния диалогов и user_data бота между перезапусками
+CREATE TABLE bot_persistence (
+    kind VARCHAR(20) NOT NULL,
+    name VARCHAR(100) NOT NULL DEFAULT '',
+    key TEXT NOT NULL,
+    data BYTEA,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, name, key)
+);
+
 -- Индексы
 CREATE INDEX idx_users_telegram_id ON users(telegram_id);
 CREATE INDEX idx_users_role ON users(role);
 CREATE INDEX idx_users_blood_type ON users(blood_type);
 CREATE INDEX idx_users_city ON users(city);
+CREATE INDEX idx_users_city_key ON users(city_key, blood_type) WHERE role = 'user';
+CREATE INDEX idx_users_eligible_from ON users(blood_type, eligible_from) WHERE role = 'user' AND is_registered = TRUE;
+CREATE INDEX idx_users_eligibility_reminders ON users(eligible_from) WHERE role = 'user' AND is_registered = TRUE AND eligibility_reminded_for IS DISTINCT FROM eligible_from;
+CREATE INDEX idx_users_certificate_date ON users(medical_certificate_date) WHERE medical_certificate_date IS NOT NULL;
 CREATE INDEX idx_medical_centers_city ON medical_centers(city);
+CREATE INDEX idx_medical_centers_coords ON medical_centers(latitude, longitude) WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
 CREATE INDEX idx_blood_needs_status ON blood_needs(status);
+CREATE INDEX idx_donation_requests_blood_date ON donation_requests(blood_type, request_date, id);
+CREATE INDEX idx_outbox_pending ON notification_outbox(next_attempt_at, id) WHERE status = 'pending';
+
+-- Нечеткий поиск города (необязательно, нужно расширение pg_trgm)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_users_city_key_trgm ON users USING gin (city_key gin_trgm_ops);
+
+-- Статистика пользователей, пересчитывается фоновой задачей (stats.py)
+CREATE MATERIALIZED VIEW donor_stats AS
+SELECT role,
+       COALESCE(blood_type, '') AS blood_type,
+       COALESCE(city_key, '') AS city_key,
+       COALESCE(MIN(city), MIN(TRIM(SPLIT_PART(location, ',', 1)))) AS city,
+       COUNT(*) AS users,
+       COUNT(*) FILTER (WHERE last_donation_date IS NULL) AS new_donors,
+       COUNT(*) FILTER (WHERE eligible_from IS NULL OR eligible_from <= CURRENT_DATE) AS eligible
+FROM users
+WHERE is_registered = TRUE
+GROUP BY 1, 2, 3;
+CREATE UNIQUE INDEX idx_donor_stats_key ON donor_stats(role, blood_type, city_key);
+
+-- Число откликов по запросам и всего (request_id = 0), пересчитывается вместе с donor_stats
+CREATE MATERIALIZED VIEW response_stats AS
+SELECT COALESCE(request_id, 0) AS request_id, COUNT(*) AS responses
+FROM donor_responses
+GROUP BY GROUPING SETS ((request_id), ());
+CREATE UNIQUE INDEX idx_response_stats_request ON response_stats(request_id);
 
 -- Комментарии
 COMMENT ON TABLE medical_centers IS 'Медицинские центры';
 COMMENT ON TABLE blood_needs IS 'Потребности в крови по центрам';
 COMMENT ON TABLE users IS 'Пользователи (доноры и врачи)';
+COMMENT ON TABLE notification_outbox IS 'Очередь исходящих уведомлений';
+COMMENT ON TABLE bot_persistence IS 'Сохраненные состояния диалогов бота';
+COMMENT ON MATERIALIZED VIEW donor_stats IS 'Статистика пользователей по группам крови и городам';
+COMMENT ON MATERIALIZED VIEW response_stats IS 'Число откликов доноров по запросам';
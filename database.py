@@ -0,0 +1,448 @@
+"""
+Доступ к PostgreSQL: пул соединений и исполнитель запросов вне event loop,
+общие для BloodDonorBot и UserFunctions
+"""
+
+import asyncio
+import itertools
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class PooledConnection:
+    """Соединение из пула: close() возвращает его в пул, а не закрывает"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("Соединение уже возвращено в пул")
+        return getattr(self._conn, name)
+
+    def __del__(self):
+        # Страховка для обработчиков, которые упали до conn.close()
+        if self._conn is not None:
+            logger.debug("Соединение не было возвращено в пул явно")
+            self.close()
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2 с ограничением размера,
+    таймаутом ожидания, проверкой живости соединений и метриками
+    """
+
+    def __init__(self, db_config, min_size=1, max_size=10, acquire_timeout=5.0,
+                 health_check_interval=30.0, max_idle=600.0):
+        if min_size > max_size:
+            raise ValueError("min_size не может быть больше max_size")
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.max_idle = max_idle
+
+        self._idle = deque()  # (conn, время возврата в пул)
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._metrics = {
+            'created': 0,
+            'discarded': 0,
+            'acquired': 0,
+            'released': 0,
+            'timeouts': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def open(self):
+        """Заранее открывает min_size соединений"""
+        conns = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= self.min_size:
+                        break
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                self.release(conn)
+
+    def close(self):
+        """Закрывает все простаивающие соединения и запрещает новые"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+        logger.info(f"Пул соединений закрыт: {self.stats()}")
+
+    def acquire(self, timeout=None):
+        """Берет соединение из пула (блокирующий вызов)"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn, last_used = self._checkout(deadline)
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._metrics['acquired'] += 1
+                self._metrics['wait_time_total'] += waited
+                self._metrics['wait_time_max'] = max(self._metrics['wait_time_max'], waited)
+            return conn
+
+    def release(self, conn):
+        """Возвращает соединение в пул, откатывая незавершенную транзакцию"""
+        status = conn.get_transaction_status() if not conn.closed else None
+        if status is None or status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            self._discard(conn)
+            return
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+
+        with self._cond:
+            self._metrics['released'] += 1
+            if self._closed:
+                self._size -= 1
+                close_now = True
+            else:
+                self._idle.append((conn, time.monotonic()))
+                close_now = False
+            self._cond.notify()
+        if close_now:
+            self._close_quietly(conn)
+
+    def get_connection(self, timeout=None):
+        """Соединение с интерфейсом psycopg2, close() которого возвращает его в пул"""
+        return PooledConnection(self, self.acquire(timeout))
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @asynccontextmanager
+    async def acquire_async(self, timeout=None):
+        """Асинхронное получение соединения без блокировки event loop"""
+        conn = await asyncio.to_thread(self.acquire, timeout)
+        try:
+            yield conn
+        finally:
+            await asyncio.to_thread(self.release, conn)
+
+    def stats(self):
+        """Текущее состояние пула и накопленные метрики"""
+        with self._cond:
+            stats = dict(self._metrics)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['max_size'] = self.max_size
+        if stats['acquired']:
+            stats['wait_time_avg'] = stats['wait_time_total'] / stats['acquired']
+        return stats
+
+    def _checkout(self, deadline):
+        """Ждет свободное соединение или слот под новое; (None, None) - надо создать"""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.InterfaceError("Пул соединений закрыт")
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout(
+                        f"Нет свободных соединений в пуле (max_size={self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(**self.db_config)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._metrics['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        idle_for = time.monotonic() - last_used
+        if idle_for > self.max_idle:
+            return False
+        if idle_for < self.health_check_interval:
+            return True
+
+        with self._cond:
+            self._metrics['health_checks'] += 1
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Соединение из пула не прошло проверку: {e}")
+            with self._cond:
+                self._metrics['health_check_failures'] += 1
+            return False
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._metrics['discarded'] += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class QueueFull(Exception):
+    """Очередь запросов к базе переполнена"""
+
+
+def _caller_name(depth=2):
+    """Имя функции-обработчика, из которой пришел запрос (для метрик)"""
+    try:
+        return sys._getframe(depth).f_code.co_name
+    except ValueError:
+        return 'unknown'
+
+
+class Database:
+    """
+    Выполняет блокирующие вызовы psycopg2 в ограниченном пуле потоков,
+    чтобы обработчики не останавливали event loop, и собирает время
+    выполнения запросов по обработчикам
+    """
+
+    def __init__(self, pool, workers=8, queue_size=100, queue_timeout=10.0, slow_query_ms=200):
+        self.pool = pool
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.slow_query_ms = slow_query_ms
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        # Одновременно в работе и в очереди не больше workers + queue_size задач
+        self._slots = asyncio.Semaphore(workers + queue_size)
+        self._timings = defaultdict(lambda: {'count': 0, 'errors': 0, 'total_ms': 0.0,
+                                             'max_ms': 0.0, 'queue_ms': 0.0})
+        self._timings_lock = threading.Lock()
+        self._stream_ids = itertools.count(1)
+
+    async def run(self, func, *args, label=None):
+        """
+        Выполняет func(cursor, *args) в отдельном потоке в одной транзакции
+        и возвращает ее результат. Курсор - RealDictCursor.
+        """
+        label = label or _caller_name()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise QueueFull(f"Очередь запросов к БД переполнена ({label})")
+
+        try:
+            submitted = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self._run_in_thread, func, args, label, submitted
+            )
+        finally:
+            self._slots.release()
+
+    async def fetchone(self, sql, params=None, label=None):
+        return await self.run(_fetchone, sql, params, label=label or _caller_name())
+
+    async def fetchall(self, sql, params=None, label=None):
+        return await self.run(_fetchall, sql, params, label=label or _caller_name())
+
+    async def fetchval(self, sql, params=None, label=None):
+        """Первое значение первой строки или None"""
+        return await self.run(_fetchval, sql, params, label=label or _caller_name())
+
+    async def execute(self, sql, params=None, label=None):
+        """Выполняет запрос и возвращает число затронутых строк"""
+        return await self.run(_execute, sql, params, label=label or _caller_name())
+
+    async def stream(self, sql, params=None, chunk_size=1000, label=None):
+        """
+        Отдает результат запроса порциями по chunk_size строк через серверный
+        (именованный) курсор, не загружая всю выборку в память.
+        Соединение занято, пока генератор не будет исчерпан или закрыт.
+        """
+        label = label or _caller_name()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise QueueFull(f"Очередь запросов к БД переполнена ({label})")
+
+        loop = asyncio.get_running_loop()
+        db_time = 0.0
+        failed = False
+        conn = None
+
+        async def call(func, *args):
+            # Учитываем только время работы с базой, без обработки порций
+            nonlocal db_time
+            started = time.perf_counter()
+            try:
+                return await loop.run_in_executor(self._executor, func, *args)
+            finally:
+                db_time += time.perf_counter() - started
+
+        try:
+            conn = await call(self.pool.acquire)
+            cursor = conn.cursor(name=f"stream_{next(self._stream_ids)}", cursor_factory=RealDictCursor)
+            cursor.itersize = chunk_size
+            try:
+                await call(cursor.execute, sql, params)
+                while True:
+                    rows = await call(cursor.fetchmany, chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                await call(_close_quietly, cursor)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if conn is not None:
+                # release() откатит транзакцию, открытую курсором
+                await loop.run_in_executor(self._executor, self.pool.release, conn)
+            self._slots.release()
+            self._record(label, db_time * 1000, 0.0, failed)
+
+    def stats(self):
+        """Время выполнения запросов по обработчикам, самые тяжелые первыми"""
+        with self._timings_lock:
+            rows = {label: dict(t) for label, t in self._timings.items()}
+        for t in rows.values():
+            t['avg_ms'] = t['total_ms'] / t['count'] if t['count'] else 0.0
+        return dict(sorted(rows.items(), key=lambda kv: kv[1]['total_ms'], reverse=True))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+    def _run_in_thread(self, func, args, label, submitted):
+        started = time.perf_counter()
+        queue_ms = (started - submitted) * 1000
+        failed = False
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                try:
+                    result = func(cursor, *args)
+                    conn.commit()
+                    return result
+                except Exception:
+                    failed = True
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._record(label, elapsed_ms, queue_ms, failed)
+
+    def _record(self, label, elapsed_ms, queue_ms, failed):
+        with self._timings_lock:
+            t = self._timings[label]
+            t['count'] += 1
+            t['total_ms'] += elapsed_ms
+            t['queue_ms'] += queue_ms
+            t['max_ms'] = max(t['max_ms'], elapsed_ms)
+            if failed:
+                t['errors'] += 1
+        if elapsed_ms >= self.slow_query_ms:
+            logger.warning(f"Медленный запрос в {label}: {elapsed_ms:.0f} мс "
+                           f"(ожидание в очереди {queue_ms:.0f} мс)")
+
+
+def _fetchone(cursor, sql, params):
+    cursor.execute(sql, params)
+    return cursor.fetchone()
+
+
+def _fetchall(cursor, sql, params):
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+def _fetchval(cursor, sql, params):
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    return next(iter(row.values())) if row else None
+
+
+def _execute(cursor, sql, params):
+    cursor.execute(sql, params)
+    return cursor.rowcount
+
+
+def _close_quietly(cursor):
+    try:
+        cursor.close()
+    except psycopg2.Error:
+        pass
@@ -0,0 +1,21 @@
+"""
+Правило интервала между сдачами крови. Дату, с которой донор снова может
+сдавать кровь, хранит столбец users.eligible_from: его вычисляет сама база
+из last_donation_date при каждой записи (миграция 0007), обработчики только
+читают его и фильтруют по нему
+"""
+
+from datetime import date
+
+# Должно совпадать с выражением столбца eligible_from в migrations/0007
+DONATION_INTERVAL_DAYS = 60
+
+# Условие для WHERE: донор может сдавать кровь сегодня (никогда не сдавал или интервал прошел)
+ELIGIBLE_SQL = "(eligible_from IS NULL OR eligible_from <= CURRENT_DATE)"
+
+
+def days_left(eligible_from, on_date=None):
+    """Сколько дней осталось до eligible_from (0 - можно сдавать уже on_date)"""
+    if eligible_from is None:
+        return 0
+    return max(0, (eligible_from - (on_date or date.today())).days)
@@ -0,0 +1,169 @@
+"""
+Поиск по расстоянию: грубый отбор по прямоугольнику на индексированных
+latitude/longitude и точный гаверсинус только для попавших в него строк,
+в SQL-запросах и в индексе медцентров в памяти
+"""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:  # numpy не обязателен, есть реализация на чистом Python
+    np = None
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+# На коротких массивах накладные расходы numpy больше выигрыша
+NUMPY_MIN_BATCH = 32
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Расстояние между двумя точками в км"""
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lon / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_many(lat, lon, lats, lons, radius_km):
+    """
+    Расстояния в км от точки (lat, lon) до каждой из точек (lats[i], lons[i])
+    и маска "в радиусе radius_km" за один вызов. С numpy возвращает массивы
+    numpy, без него - списки.
+    """
+    if np is not None and len(lats) >= NUMPY_MIN_BATCH:
+        lat1 = math.radians(lat)
+        lats = np.radians(np.asarray(lats, dtype=float))
+        lons = np.radians(np.asarray(lons, dtype=float))
+        a = (np.sin((lats - lat1) / 2) ** 2 +
+             math.cos(lat1) * np.cos(lats) * np.sin((lons - math.radians(lon)) / 2) ** 2)
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+        return distances, distances <= radius_km
+
+    distances = [haversine(lat, lon, p_lat, p_lon) for p_lat, p_lon in zip(lats, lons)]
+    return distances, [distance <= radius_km for distance in distances]
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Прямоугольник (min_lat, max_lat, min_lon, max_lon), гарантированно
+    содержащий круг радиуса radius_km. Рядом с полюсами и линией перемены
+    дат долгота не ограничивается.
+    """
+    d_lat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = lat - d_lat, lat + d_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+
+    # Самая широкая по долготе точка круга лежит ближе к полюсу, чем центр
+    d_lon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    min_lon, max_lon = lon - d_lon, lon + d_lon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def distance_sql(lat_column='latitude', lon_column='longitude'):
+    """SQL-выражение гаверсинуса в км; параметры: широта, широта, долгота точки"""
+    return f"""
+        2 * {EARTH_RADIUS_KM} * ASIN(LEAST(1, SQRT(
+            POWER(SIN(RADIANS({lat_column} - %s) / 2), 2) +
+            COS(RADIANS(%s)) * COS(RADIANS({lat_column})) *
+            POWER(SIN(RADIANS({lon_column} - %s) / 2), 2)
+        )))
+    """
+
+
+def radius_condition(lat, lon, radius_km, lat_column='latitude', lon_column='longitude'):
+    """
+    Условие WHERE "в радиусе radius_km от точки": прямоугольник по индексированным
+    координатам и точный гаверсинус для попавших в него строк. Возвращает (sql, params).
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    sql = f"""(
+        {lat_column} BETWEEN %s AND %s AND {lon_column} BETWEEN %s AND %s
+        AND {distance_sql(lat_column, lon_column)} <= %s
+    )"""
+    return sql, (min_lat, max_lat, min_lon, max_lon, lat, lat, lon, radius_km)
+
+
+class GridIndex:
+    """
+    Индекс точек в памяти: сетка из ячеек cell_deg x cell_deg градусов.
+    Поиск в радиусе просматривает только ячейки, пересекающие
+    ограничивающий прямоугольник круга.
+    """
+
+    def __init__(self, cell_deg=0.25):
+        self.cell_deg = cell_deg
+        self._cells = {}
+        self._points = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, item_id):
+        return item_id in self._points
+
+    def load(self, rows):
+        """Заполняет индекс строками с ключами id, latitude, longitude"""
+        self._cells.clear()
+        self._points.clear()
+        for row in rows:
+            self.upsert(row['id'], row['latitude'], row['longitude'])
+
+    def upsert(self, item_id, lat, lon):
+        """Добавляет точку или переносит ее на новые координаты"""
+        self.remove(item_id)
+        if lat is None or lon is None:
+            return
+        cell = self._cell(lat, lon)
+        self._points[item_id] = (lat, lon, cell)
+        self._cells.setdefault(cell, set()).add(item_id)
+
+    def remove(self, item_id):
+        point = self._points.pop(item_id, None)
+        if point is None:
+            return
+        ids = self._cells.get(point[2])
+        if ids is not None:
+            ids.discard(item_id)
+            if not ids:
+                del self._cells[point[2]]
+
+    def within(self, lat, lon, radius_km, limit=None):
+        """Список (distance, id) точек в радиусе radius_km, ближайшие первыми"""
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        min_i, max_i = self._index(min_lat), self._index(max_lat)
+        min_j, max_j = self._index(min_lon), self._index(max_lon)
+
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self._cells):
+            # Прямоугольник больше, чем занятых ячеек - дешевле пройти по ним
+            cells = [ids for (i, j), ids in self._cells.items()
+                     if min_i <= i <= max_i and min_j <= j <= max_j]
+        else:
+            cells = [self._cells[(i, j)] for i in range(min_i, max_i + 1)
+                     for j in range(min_j, max_j + 1) if (i, j) in self._cells]
+
+        ids, lats, lons = [], [], []
+        for cell in cells:
+            for item_id in cell:
+                p_lat, p_lon, _ = self._points[item_id]
+                if min_lat <= p_lat <= max_lat and min_lon <= p_lon <= max_lon:
+                    ids.append(item_id)
+                    lats.append(p_lat)
+                    lons.append(p_lon)
+        if not ids:
+            return []
+
+        distances, mask = haversine_many(lat, lon, lats, lons, radius_km)
+        found = sorted((float(distance), item_id)
+                       for distance, item_id, inside in zip(distances, ids, mask) if inside)
+        return found[:limit] if limit is not None else found
+
+    def _index(self, degrees):
+        return math.floor(degrees / self.cell_deg)
+
+    def _cell(self, lat, lon):
+        return self._index(lat), self._index(lon)
@@ -0,0 +1,116 @@
+"""
+Нагрузочная проверка обработки обновлений: пропускная способность
+при разном UPDATE_CONCURRENCY и сохранение порядка внутри чата.
+
+Бот работает с заглушкой Bot API (stub_telegram.py), запущенной в отдельном
+процессе; обработчик имитирует медленную работу (запрос к БД, рассылку)
+через sleep. С --reply он еще и отвечает пользователю через Bot API - тогда
+при большом числе параллельных запросов упор идет в HTTP-клиент бота (httpx).
+Запуск: python load_test.py [--updates 400 --chats 50 --delay 0.05 --reply]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+
+import aiohttp
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+
+from stub_telegram import StubTelegram
+from update_processor import ChatOrderedUpdateProcessor
+
+CONCURRENCY_LEVELS = (1, 4, 16, 64)
+
+
+async def run_level(api_url, concurrency, updates, delay, reply):
+    seen = {}  # chat_id -> номера сообщений в порядке обработки
+    done = asyncio.Event()
+    processed = 0
+
+    async def handle(update, context):
+        nonlocal processed
+        await asyncio.sleep(delay)
+        if reply:
+            await update.message.reply_text("ok")
+        seen.setdefault(update.effective_chat.id, []).append(int(update.message.text))
+        processed += 1
+        if processed == len(updates):
+            done.set()
+
+    application = Application.builder().token('1000000:stub') \
+        .base_url(f"{api_url}/bot") \
+        .concurrent_updates(ChatOrderedUpdateProcessor(concurrency)) \
+        .build()
+    application.add_handler(MessageHandler(filters.TEXT, handle))
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        for data in updates:
+            application.update_queue.put_nowait(Update.de_json(data, application.bot))
+        await done.wait()
+        elapsed = time.perf_counter() - started
+        await application.stop()
+
+    ordered = all(numbers == sorted(numbers) for numbers in seen.values())
+    return elapsed, ordered
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_stub(port):
+    web.run_app(StubTelegram().app, host='127.0.0.1', port=port, print=None)
+
+
+async def wait_for_stub(api_url, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.post(f"{api_url}/bot1000000:stub/getMe"):
+                    return
+            except aiohttp.ClientConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+async def main(args):
+    # Заглушка в своем процессе, чтобы ее работа не отнимала время у бота
+    port = free_port()
+    stub_process = multiprocessing.Process(target=run_stub, args=(port,), daemon=True)
+    stub_process.start()
+    api_url = f"http://127.0.0.1:{port}"
+    await wait_for_stub(api_url)
+
+    # Сообщения чата пронумерованы, чтобы проверить порядок обработки
+    stub = StubTelegram()
+    updates = [stub.text_update(1 + i % args.chats, str(i)) for i in range(args.updates)]
+
+    print(f"обновлений: {args.updates}, чатов: {args.chats}, задержка обработчика: {args.delay * 1000:.0f} мс")
+    print(f"{'параллельно':>12} {'время, с':>10} {'обн./с':>10} {'порядок в чате':>16}")
+    try:
+        for concurrency in CONCURRENCY_LEVELS:
+            elapsed, ordered = await run_level(api_url, concurrency, updates, args.delay, args.reply)
+            print(f"{concurrency:>12} {elapsed:>10.2f} {args.updates / elapsed:>10.0f} "
+                  f"{'сохранен' if ordered else 'НАРУШЕН':>16}")
+    finally:
+        stub_process.terminate()
+        stub_process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка обработки обновлений")
+    parser.add_argument('--updates', type=int, default=400)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--delay', type=float, default=0.05, help="время работы обработчика, с")
+    parser.add_argument('--reply', action='store_true', help="отвечать на каждое сообщение через Bot API")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,137 @@
+"""
+Версионные миграции схемы базы данных.
+
+Миграции лежат в каталоге migrations/ и применяются по порядку номеров:
+NNNN_описание.sql выполняется как есть, NNNN_описание.py должен содержать
+функцию upgrade(cursor). Каждая миграция идет в своей транзакции вместе
+с записью в schema_version. Несколько реплик бота, стартующих одновременно,
+применяют миграции по очереди под advisory lock.
+
+Запуск вручную: python migrate.py
+"""
+
+import importlib.util
+import logging
+import os
+import re
+
+import psycopg2
+from psycopg2 import errors
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+# Ключ pg_advisory_lock, общий для всех реплик бота
+ADVISORY_LOCK_KEY = 0x426C6F6F64
+
+_MIGRATION_NAME = re.compile(r'^(\d+)_\w+\.(sql|py)$')
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def apply(self, cursor):
+        if self.path.endswith('.sql'):
+            with open(self.path, encoding='utf-8') as f:
+                cursor.execute(f.read())
+        else:
+            spec = importlib.util.spec_from_file_location(f"migration_{self.version}", self.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.upgrade(cursor)
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Миграции из каталога, отсортированные по номеру версии"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _MIGRATION_NAME.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), filename, os.path.join(directory, filename)))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Повторяющиеся номера миграций в {directory}")
+    return migrations
+
+
+def current_version(conn):
+    """Последняя примененная версия схемы (0 для пустой базы)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+    except errors.UndefinedTable:
+        return 0
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def migrate(conn, directory=MIGRATIONS_DIR):
+    """
+    Применяет недостающие миграции и возвращает список их имен.
+    Если схема актуальна, обходится одним запросом без блокировок.
+    """
+    migrations = load_migrations(directory)
+    if not migrations or current_version(conn) >= migrations[-1].version:
+        return []
+
+    cursor = conn.cursor()
+    applied = []
+    try:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+
+        # Пока ждали блокировку, миграции могла применить другая реплика
+        version = current_version(conn)
+        for migration in migrations:
+            if migration.version <= version:
+                continue
+            try:
+                migration.apply(cursor)
+                cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                               (migration.version, migration.name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.error(f"Миграция {migration.name} не применена")
+                raise
+            applied.append(migration.name)
+            logger.info(f"Применена миграция {migration.name}")
+    finally:
+        if not conn.closed:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+            conn.commit()
+        cursor.close()
+    return applied
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    load_dotenv()
+    connection = psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        database=os.getenv('DB_NAME', 'blood_donor_bot'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD', 'vadamahjkl'),
+        port=os.getenv('DB_PORT', '5432'),
+    )
+    try:
+        names = migrate(connection)
+        print(f"Применено миграций: {len(names)}" if names else "Схема уже актуальна")
+    finally:
+        connection.close()
@@ -0,0 +1,78 @@
+-- Исходная схема бота. Все команды идемпотентны, чтобы миграция
+-- проходила и на базах, созданных прежним init_database
+
+-- Медицинские центры
+CREATE TABLE IF NOT EXISTS medical_centers (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    address VARCHAR(255) NOT NULL,
+    city VARCHAR(100) NOT NULL,
+    latitude FLOAT,
+    longitude FLOAT,
+    login VARCHAR(50) UNIQUE NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    contact_info TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Пользователи (доноры и врачи)
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    telegram_id BIGINT UNIQUE NOT NULL,
+    username VARCHAR(255),
+    first_name VARCHAR(255),
+    last_name VARCHAR(255),
+    role VARCHAR(20) NOT NULL CHECK (role IN ('user', 'doctor')),
+    blood_type VARCHAR(10),
+    location VARCHAR(255),
+    last_donation_date DATE,
+    is_registered BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS city VARCHAR(100);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS latitude FLOAT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS longitude FLOAT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS medical_certificate_file_id VARCHAR(255);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS medical_certificate_date DATE;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_number VARCHAR(20);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS medical_center_id INTEGER REFERENCES medical_centers(id);
+
+-- Потребности в крови по центрам (светофор)
+CREATE TABLE IF NOT EXISTS blood_needs (
+    id SERIAL PRIMARY KEY,
+    medical_center_id INTEGER REFERENCES medical_centers(id),
+    blood_type VARCHAR(10) NOT NULL,
+    status VARCHAR(20) DEFAULT 'ok',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(medical_center_id, blood_type)
+);
+
+-- Отклики доноров
+CREATE TABLE IF NOT EXISTS donation_responses (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT REFERENCES users(telegram_id),
+    medical_center_id INTEGER REFERENCES medical_centers(id),
+    status VARCHAR(20) DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Старая таблица запросов (оставлена для совместимости и истории)
+CREATE TABLE IF NOT EXISTS donation_requests (
+    id SERIAL PRIMARY KEY,
+    doctor_id BIGINT NOT NULL,
+    medical_center_id INTEGER REFERENCES medical_centers(id),
+    blood_type VARCHAR(10) NOT NULL,
+    location VARCHAR(255) NOT NULL,
+    address VARCHAR(255) NOT NULL,
+    hospital_name VARCHAR(255),
+    contact_info TEXT,
+    request_date DATE NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (doctor_id) REFERENCES users(telegram_id)
+);
+
+ALTER TABLE donation_requests ADD COLUMN IF NOT EXISTS medical_center_id INTEGER REFERENCES medical_centers(id);
+ALTER TABLE donation_requests ADD COLUMN IF NOT EXISTS hospital_name VARCHAR(255);
+ALTER TABLE donation_requests ADD COLUMN IF NOT EXISTS contact_info TEXT;
@@ -0,0 +1,30 @@
+-- Очередь исходящих рассылок: переживает перезапуск бота
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(30) NOT NULL,
+    dedup_key VARCHAR(100) UNIQUE,
+    text TEXT NOT NULL,
+    reply_markup JSONB,
+    parse_mode VARCHAR(20),
+    status_chat_id BIGINT,
+    status_message_id BIGINT,
+    completed_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- По строке на получателя
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    broadcast_id INTEGER NOT NULL REFERENCES broadcasts(id) ON DELETE CASCADE,
+    chat_id BIGINT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'sent', 'failed', 'blocked')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (broadcast_id, chat_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_pending
+ON notification_outbox (next_attempt_at, id) WHERE status = 'pending';
@@ -0,0 +1,19 @@
+-- Индексы, которых не было в исходной схеме
+
+CREATE INDEX IF NOT EXISTS idx_users_role ON users (role);
+CREATE INDEX IF NOT EXISTS idx_blood_needs_status ON blood_needs (status);
+CREATE INDEX IF NOT EXISTS idx_medical_centers_city ON medical_centers (city);
+
+-- Поиск медцентров в радиусе (прямоугольник по координатам)
+CREATE INDEX IF NOT EXISTS idx_medical_centers_coords
+ON medical_centers (latitude, longitude)
+WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
+
+-- Входящие запросы донора: группа крови + постраничный обход по дате
+CREATE INDEX IF NOT EXISTS idx_donation_requests_blood_date
+ON donation_requests (blood_type, request_date, id);
+
+-- Поиск доноров для рассылки: группа крови + дата последней сдачи
+CREATE INDEX IF NOT EXISTS idx_users_eligible_donors
+ON users (blood_type, last_donation_date)
+WHERE role = 'user' AND is_registered = TRUE;
@@ -0,0 +1,9 @@
+-- Состояния диалогов и user_data между перезапусками бота
+CREATE TABLE IF NOT EXISTS bot_persistence (
+    kind VARCHAR(20) NOT NULL,
+    name VARCHAR(100) NOT NULL DEFAULT '',
+    key TEXT NOT NULL,
+    data BYTEA,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, name, key)
+);
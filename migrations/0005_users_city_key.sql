@@ -0,0 +1,15 @@
+-- Нормализованный ключ города (cities.city_key) вместо ILIKE '%город%'
+ALTER TABLE users ADD COLUMN IF NOT EXISTS city_key VARCHAR(100);
+
+CREATE INDEX IF NOT EXISTS idx_users_city_key
+ON users (city_key, blood_type) WHERE role = 'user';
+
+-- Нечеткий поиск по ключу города, если доступно расширение pg_trgm
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS idx_users_city_key_trgm ON users USING gin (city_key gin_trgm_ops);
+EXCEPTION WHEN OTHERS THEN
+    RAISE WARNING 'pg_trgm недоступен, нечеткий поиск города будет без индекса: %', SQLERRM;
+END
+$$;
@@ -0,0 +1,22 @@
+"""
+Ключи городов для пользователей, зарегистрированных до появления city_key
+"""
+
+from psycopg2.extras import execute_values
+
+from cities import COORDINATES_PREFIX, city_key
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        SELECT telegram_id, location FROM users
+        WHERE city_key IS NULL AND location IS NOT NULL AND location NOT LIKE %s
+    """, (COORDINATES_PREFIX + '%',))
+    keys = [(key, telegram_id) for telegram_id, location in cursor.fetchall()
+            if (key := city_key(location))]
+    if keys:
+        execute_values(cursor, """
+            UPDATE users u SET city_key = v.city_key
+            FROM (VALUES %s) AS v (city_key, telegram_id)
+            WHERE u.telegram_id = v.telegram_id
+        """, keys)
@@ -0,0 +1,10 @@
+-- Дата, с которой донор снова может сдавать кровь (60 дней после последней сдачи,
+-- eligibility.DONATION_INTERVAL_DAYS). Столбец вычисляется при каждой записи
+-- last_donation_date, поэтому поиск подходящих доноров - сканирование диапазона
+ALTER TABLE users ADD COLUMN IF NOT EXISTS eligible_from DATE
+    GENERATED ALWAYS AS (last_donation_date + 60) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_users_eligible_from
+ON users (blood_type, eligible_from) WHERE role = 'user' AND is_registered = TRUE;
+
+DROP INDEX IF EXISTS idx_users_eligible_donors;
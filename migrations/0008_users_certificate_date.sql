@@ -0,0 +1,3 @@
+-- Фоновое удаление просроченных справок (certificates.expire_certificates)
+CREATE INDEX IF NOT EXISTS idx_users_certificate_date
+ON users (medical_certificate_date) WHERE medical_certificate_date IS NOT NULL;
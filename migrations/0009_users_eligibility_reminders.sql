@@ -0,0 +1,8 @@
+-- Напоминание «можно снова сдавать кровь» (reminders.py): для какой даты
+-- eligible_from донору уже отправлено напоминание
+ALTER TABLE users ADD COLUMN IF NOT EXISTS eligibility_reminded_for DATE;
+
+-- В индексе только доноры, которым напоминание еще предстоит
+CREATE INDEX IF NOT EXISTS idx_users_eligibility_reminders
+ON users (eligible_from)
+WHERE role = 'user' AND is_registered = TRUE AND eligibility_reminded_for IS DISTINCT FROM eligible_from;
@@ -0,0 +1,17 @@
+-- Статистика пользователей (stats.py): число пользователей по роли, группе крови
+-- и городу, новые доноры и доноры, которые могут сдавать кровь сегодня.
+-- Пересчитывается фоновой задачей, экраны статистики читают только его
+CREATE MATERIALIZED VIEW IF NOT EXISTS donor_stats AS
+SELECT role,
+       COALESCE(blood_type, '') AS blood_type,
+       COALESCE(city_key, '') AS city_key,
+       MIN(city) AS city,
+       COUNT(*) AS users,
+       COUNT(*) FILTER (WHERE last_donation_date IS NULL) AS new_donors,
+       COUNT(*) FILTER (WHERE eligible_from IS NULL OR eligible_from <= CURRENT_DATE) AS eligible
+FROM users
+WHERE is_registered = TRUE
+GROUP BY 1, 2, 3;
+
+-- Нужен для REFRESH MATERIALIZED VIEW CONCURRENTLY (чтение не блокируется)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_donor_stats_key ON donor_stats (role, blood_type, city_key);
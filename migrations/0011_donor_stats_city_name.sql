@@ -0,0 +1,17 @@
+-- users.city не заполняется, название города для статистики берется
+-- из location (часть до запятой, как в cities.city_key)
+DROP MATERIALIZED VIEW IF EXISTS donor_stats;
+
+CREATE MATERIALIZED VIEW donor_stats AS
+SELECT role,
+       COALESCE(blood_type, '') AS blood_type,
+       COALESCE(city_key, '') AS city_key,
+       COALESCE(MIN(city), MIN(TRIM(SPLIT_PART(location, ',', 1)))) AS city,
+       COUNT(*) AS users,
+       COUNT(*) FILTER (WHERE last_donation_date IS NULL) AS new_donors,
+       COUNT(*) FILTER (WHERE eligible_from IS NULL OR eligible_from <= CURRENT_DATE) AS eligible
+FROM users
+WHERE is_registered = TRUE
+GROUP BY 1, 2, 3;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_donor_stats_key ON donor_stats (role, blood_type, city_key);
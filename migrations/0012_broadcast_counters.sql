@@ -0,0 +1,20 @@
+-- Счетчики рассылки хранятся в broadcasts и обновляются вместе с outbox,
+-- чтобы прогресс не пересчитывался по всем строкам получателей
+ALTER TABLE broadcasts
+    ADD COLUMN IF NOT EXISTS total INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS sent INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS failed INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS blocked INTEGER NOT NULL DEFAULT 0;
+
+UPDATE broadcasts b
+SET total = c.total, sent = c.sent, failed = c.failed, blocked = c.blocked
+FROM (
+    SELECT broadcast_id,
+           COUNT(*) AS total,
+           COUNT(*) FILTER (WHERE status = 'sent') AS sent,
+           COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+           COUNT(*) FILTER (WHERE status = 'blocked') AS blocked
+    FROM notification_outbox
+    GROUP BY broadcast_id
+) c
+WHERE b.id = c.broadcast_id;
@@ -0,0 +1,5 @@
+-- Получатели рассылки могут добавляться порциями; пока флаг не установлен,
+-- рассылка не считается завершенной, даже если очередь уже пуста
+ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS recipients_complete BOOLEAN NOT NULL DEFAULT FALSE;
+
+UPDATE broadcasts SET recipients_complete = TRUE;
@@ -0,0 +1,19 @@
+-- Отклики доноров на запросы крови. Таблицу использует bot_debug.py,
+-- но в схеме ее не было; уникальный ключ начинается с request_id
+CREATE TABLE IF NOT EXISTS donor_responses (
+    id SERIAL PRIMARY KEY,
+    request_id INTEGER NOT NULL REFERENCES donation_requests(id) ON DELETE CASCADE,
+    donor_id BIGINT NOT NULL,
+    response_type VARCHAR(20) NOT NULL DEFAULT 'interested',
+    responded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (request_id, donor_id)
+);
+
+-- Число откликов по запросам и всего (строка request_id = 0) для экрана
+-- статистики врача; пересчитывается вместе с donor_stats (stats.py)
+CREATE MATERIALIZED VIEW IF NOT EXISTS response_stats AS
+SELECT COALESCE(request_id, 0) AS request_id, COUNT(*) AS responses
+FROM donor_responses
+GROUP BY GROUPING SETS ((request_id), ());
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_response_stats_request ON response_stats (request_id);
@@ -0,0 +1,144 @@
+"""
+Доска потребностей в крови для донорского светофора: в памяти хранятся
+только медцентры со статусом 'need' или 'urgent', разложенные по ячейкам
+сетки (по координатам) и по городам (для центров без координат)
+"""
+
+from cities import city_key
+from geo import GridIndex
+from traffic_light import BLOOD_TYPES
+
+ACTIVE_STATUSES = ('need', 'urgent')
+
+
+class NeedsBoard:
+    """
+    Медцентры с активными потребностями. Заполняется целиком при старте
+    и обновляется точечно при переключении статуса во врачебном светофоре,
+    поэтому просмотр донором не зависит от общего числа медцентров
+    """
+
+    def __init__(self, cell_deg=0.25):
+        self._centers = {}  # mc_id -> {'name', 'city', 'latitude', 'longitude'}
+        self._needs = {}  # mc_id -> {группа крови: статус}, только активные
+        self._index = GridIndex(cell_deg)  # центры с потребностями и координатами
+        self._cities = {}  # city_key -> {mc_id} центров с потребностями
+
+    def __len__(self):
+        return len(self._needs)
+
+    def knows(self, mc_id):
+        return mc_id in self._centers
+
+    def load(self, centers, needs):
+        """
+        Заполняет доску строками medical_centers (id, name, city, latitude,
+        longitude) и blood_needs (medical_center_id, blood_type, status)
+        """
+        self._centers.clear()
+        self._needs.clear()
+        self._index.load([])
+        self._cities.clear()
+        for row in centers:
+            self._centers[row['id']] = self._center_info(row)
+        for row in needs:
+            if row['medical_center_id'] in self._centers:
+                self.set_status(row['medical_center_id'], row['blood_type'], row['status'])
+
+    def set_center(self, mc_id, row):
+        """Добавляет медцентр или обновляет его название, город и координаты"""
+        needs = self._needs.pop(mc_id, {})
+        self._unlink(mc_id)
+        self._centers[mc_id] = self._center_info(row)
+        if needs:
+            self._needs[mc_id] = needs
+            self._link(mc_id)
+
+    def remove_center(self, mc_id):
+        self._unlink(mc_id)
+        self._needs.pop(mc_id, None)
+        self._centers.pop(mc_id, None)
+
+    def set_status(self, mc_id, blood_type, status):
+        """Обновляет статус группы крови медцентра (центр должен быть известен доске)"""
+        needs = self._needs.get(mc_id)
+        if status in ACTIVE_STATUSES:
+            if needs is None:
+                self._needs[mc_id] = {blood_type: status}
+                self._link(mc_id)
+            else:
+                needs[blood_type] = status
+        elif needs is not None:
+            needs.pop(blood_type, None)
+            if not needs:
+                del self._needs[mc_id]
+                self._unlink(mc_id)
+
+    def nearby(self, lat, lon, radius_km):
+        """Потребности медцентров в радиусе radius_km, ближайшие первыми"""
+        return [need for distance, mc_id in self._index.within(lat, lon, radius_km)
+                for need in self._rows(mc_id, distance)]
+
+    def in_city(self, city, without_coords=False):
+        """
+        Потребности медцентров, в названии города которых встречается city
+        (по ключам cities.city_key); without_coords - только центры без координат
+        """
+        key = city_key(city)
+        if not key:
+            return []
+        # Просматриваются только города, где сейчас есть потребности
+        ids = {mc_id for name, mc_ids in self._cities.items() if key in name for mc_id in mc_ids}
+        rows = []
+        for mc_id in sorted(ids):
+            if without_coords and self._has_coords(mc_id):
+                continue
+            rows.extend(self._rows(mc_id))
+        return rows
+
+    def _rows(self, mc_id, distance=None):
+        center = self._centers[mc_id]
+        needs = self._needs[mc_id]
+        return [{
+            'blood_type': bt,
+            'status': needs[bt],
+            'id': mc_id,
+            'name': center['name'],
+            'city': center['city'],
+            'latitude': center['latitude'],
+            'longitude': center['longitude'],
+            'distance': distance,
+        } for bt in BLOOD_TYPES if bt in needs]
+
+    def _has_coords(self, mc_id):
+        center = self._centers[mc_id]
+        return center['latitude'] is not None and center['longitude'] is not None
+
+    def _link(self, mc_id):
+        center = self._centers[mc_id]
+        if self._has_coords(mc_id):
+            self._index.upsert(mc_id, center['latitude'], center['longitude'])
+        key = city_key(center['city'])
+        if key:
+            self._cities.setdefault(key, set()).add(mc_id)
+
+    def _unlink(self, mc_id):
+        self._index.remove(mc_id)
+        center = self._centers.get(mc_id)
+        if center is None:
+            return
+        key = city_key(center['city'])
+        ids = self._cities.get(key)
+        if ids is not None:
+            ids.discard(mc_id)
+            if not ids:
+                del self._cities[key]
+
+    @staticmethod
+    def _center_info(row):
+        return {
+            'name': row['name'],
+            'city': row['city'],
+            'latitude': row['latitude'],
+            'longitude': row['longitude'],
+        }
@@ -0,0 +1,338 @@
+"""
+Очередь исходящих уведомлений в PostgreSQL: рассылки переживают перезапуск
+бота и могут разбираться несколькими экземплярами параллельно
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+from psycopg2.extras import execute_values
+from telegram import InlineKeyboardMarkup
+
+from broadcast import BroadcastResult
+
+logger = logging.getLogger(__name__)
+
+
+def insert_recipients(cursor, broadcast_id, chat_ids):
+    """Добавляет получателей и увеличивает счетчик total, возвращает число новых"""
+    inserted = execute_values(cursor, """
+        INSERT INTO notification_outbox (broadcast_id, chat_id) VALUES %s
+        ON CONFLICT (broadcast_id, chat_id) DO NOTHING
+        RETURNING 1
+    """, [(broadcast_id, chat_id) for chat_id in chat_ids], page_size=1000, fetch=True)
+    if inserted:
+        cursor.execute("UPDATE broadcasts SET total = total + %s WHERE id = %s", (len(inserted), broadcast_id))
+    return len(inserted)
+
+
+def _insert_broadcast(cursor, kind, text, dedup_key, reply_markup, parse_mode, status_message,
+                      recipients_complete):
+    """
+    id новой рассылки или незавершенной (recipients_complete = FALSE) с тем же
+    dedup_key; None, если рассылка с таким dedup_key уже полностью поставлена
+    """
+    cursor.execute("""
+        INSERT INTO broadcasts (kind, dedup_key, text, reply_markup, parse_mode,
+                                status_chat_id, status_message_id, recipients_complete)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (dedup_key) DO UPDATE
+        SET status_chat_id = EXCLUDED.status_chat_id, status_message_id = EXCLUDED.status_message_id
+        WHERE NOT broadcasts.recipients_complete
+        RETURNING id
+    """, (kind, dedup_key, text,
+          json.dumps(reply_markup.to_dict()) if reply_markup else None, parse_mode,
+          status_message.chat_id if status_message else None,
+          status_message.message_id if status_message else None,
+          recipients_complete))
+    row = cursor.fetchone()
+    return row['id'] if row else None
+
+
+class Outbox:
+    """
+    Рассылка = строка в broadcasts + по строке на получателя в notification_outbox.
+    Воркер забирает пачки через SELECT ... FOR UPDATE SKIP LOCKED, арендуя их
+    на lease секунд: если процесс упал посреди отправки, строки вернутся в работу
+    """
+
+    def __init__(self, db, broadcaster, batch_size=100, poll_interval=2.0, lease=300,
+                 max_attempts=5, progress_interval=5.0):
+        self.db = db
+        self.broadcaster = broadcaster
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._last_progress = {}
+        self._broadcasts = {}
+
+    async def create_broadcast(self, kind, text, dedup_key=None, reply_markup=None, parse_mode=None,
+                               status_message=None):
+        """
+        Создает рассылку, получатели которой будут добавляться порциями
+        (в конце - complete_recipients), и возвращает ее id. Если рассылка
+        с таким dedup_key уже есть, но получатели в нее добавлены не все
+        (процесс упал посреди постановки), возвращается ее id, чтобы продолжить.
+        None - рассылка с таким dedup_key уже была (повторный запуск не спамит доноров)
+        """
+        broadcast_id = await self.db.run(_insert_broadcast, kind, text, dedup_key, reply_markup, parse_mode,
+                                         status_message, False)
+        # При продолжении могло смениться сообщение с прогрессом
+        self._broadcasts.pop(broadcast_id, None)
+        return broadcast_id
+
+    async def add_recipients(self, broadcast_id, chat_ids):
+        """
+        Ставит получателей в очередь, возвращает число добавленных
+        (повторно добавленные игнорируются и не считаются)
+        """
+        chat_ids = list(chat_ids)
+        if not chat_ids:
+            return 0
+
+        queued = await self.db.run(insert_recipients, broadcast_id, chat_ids)
+        if queued:
+            self._wakeup.set()
+        return queued
+
+    async def add_recipients_from(self, broadcast_id, select):
+        """
+        Ставит в очередь получателей, которых возвращает select(cursor), в той же
+        транзакции: если select помечает выбранных, отметка и очередь не расходятся.
+        Возвращает число добавленных
+        """
+        def insert(cursor):
+            chat_ids = list(select(cursor))
+            if not chat_ids:
+                return 0
+            return insert_recipients(cursor, broadcast_id, chat_ids)
+
+        queued = await self.db.run(insert)
+        if queued:
+            self._wakeup.set()
+        return queued
+
+    async def enqueue(self, kind, text, chat_ids, dedup_key=None, reply_markup=None, parse_mode=None,
+                      status_message=None):
+        """
+        Создает рассылку и ставит всех получателей в очередь одной транзакцией:
+        dedup_key занимается только вместе с получателями
+        """
+        chat_ids = list(chat_ids)
+
+        def create(cursor):
+            broadcast_id = _insert_broadcast(cursor, kind, text, dedup_key, reply_markup, parse_mode,
+                                             status_message, True)
+            if broadcast_id is not None and chat_ids:
+                insert_recipients(cursor, broadcast_id, chat_ids)
+            return broadcast_id
+
+        broadcast_id = await self.db.run(create)
+        if broadcast_id is None:
+            logger.info(f"Рассылка {dedup_key} уже существует, повторно не отправляем")
+            return None
+        if chat_ids:
+            self._wakeup.set()
+        else:
+            # Отправлять некому - рассылка сразу завершена
+            await self.complete_recipients(broadcast_id)
+        return broadcast_id
+
+    async def enqueue_from(self, kind, text, select):
+        """
+        То же, что enqueue, но получателей выбирает select(cursor) в той же
+        транзакции. Если выбрать некого, рассылка не создается.
+        Возвращает выбранных получателей
+        """
+        def create(cursor):
+            chat_ids = list(select(cursor))
+            if chat_ids:
+                broadcast_id = _insert_broadcast(cursor, kind, text, None, None, None, None, True)
+                insert_recipients(cursor, broadcast_id, chat_ids)
+            return chat_ids
+
+        chat_ids = await self.db.run(create)
+        if chat_ids:
+            self._wakeup.set()
+        return chat_ids
+
+    async def complete_recipients(self, broadcast_id):
+        """
+        Отмечает, что все получатели рассылки поставлены в очередь. До этого
+        рассылка не завершается, даже если воркер уже разобрал добавленных
+        """
+        row = await self.db.fetchone("""
+            UPDATE broadcasts SET recipients_complete = TRUE WHERE id = %s
+            RETURNING id, total, sent, failed, blocked, recipients_complete
+        """, (broadcast_id,))
+        self._wakeup.set()
+        if row:
+            # Воркер мог разобрать очередь раньше, чем установлен флаг
+            broadcasts = await self._load_broadcasts({broadcast_id})
+            await self._update_progress(broadcasts[broadcast_id], row, time.monotonic())
+
+    def start(self, application):
+        self._task = application.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        logger.info("Воркер очереди уведомлений запущен")
+        while True:
+            try:
+                processed = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка воркера очереди уведомлений: {e}")
+                processed = 0
+            if not processed:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def drain_once(self):
+        """Забирает и отправляет одну пачку, возвращает ее размер"""
+        batch = await self.db.fetchall("""
+            WITH batch AS (
+                SELECT id FROM notification_outbox
+                WHERE status = 'pending' AND next_attempt_at <= NOW()
+                ORDER BY next_attempt_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE notification_outbox o
+            SET attempts = o.attempts + 1,
+                next_attempt_at = NOW() + %s * INTERVAL '1 second',
+                updated_at = NOW()
+            FROM batch
+            WHERE o.id = batch.id
+            RETURNING o.id, o.broadcast_id, o.chat_id, o.attempts
+        """, (self.batch_size, self.lease))
+        if not batch:
+            return 0
+
+        broadcasts = await self._load_broadcasts({row['broadcast_id'] for row in batch})
+        results = await asyncio.gather(*[self._send(row, broadcasts[row['broadcast_id']]) for row in batch])
+        await self._save_results(batch, results)
+        await self._report_progress(broadcasts)
+        return len(batch)
+
+    async def _load_broadcasts(self, broadcast_ids):
+        missing = [b for b in broadcast_ids if b not in self._broadcasts]
+        if missing:
+            rows = await self.db.fetchall("SELECT * FROM broadcasts WHERE id = ANY(%s)", (missing,))
+            for row in rows:
+                if row['reply_markup']:
+                    row['reply_markup'] = InlineKeyboardMarkup.de_json(row['reply_markup'], self.broadcaster.bot)
+                self._broadcasts[row['id']] = row
+        return {b: self._broadcasts[b] for b in broadcast_ids}
+
+    async def _send(self, row, broadcast):
+        kwargs = {}
+        if broadcast['reply_markup']:
+            kwargs['reply_markup'] = broadcast['reply_markup']
+        if broadcast['parse_mode']:
+            kwargs['parse_mode'] = broadcast['parse_mode']
+        return await self.broadcaster.send(row['chat_id'], broadcast['text'], **kwargs)
+
+    async def _save_results(self, batch, results):
+        ids, statuses, errors, retry_in = [], [], [], []
+        for row, (status, error) in zip(batch, results):
+            if status == 'retry':
+                status = 'pending' if row['attempts'] < self.max_attempts else 'failed'
+            ids.append(row['id'])
+            statuses.append(status)
+            errors.append(error)
+            # Экспоненциальная пауза перед повтором временных ошибок
+            retry_in.append(30 * 2 ** (row['attempts'] - 1))
+
+        # Счетчики рассылок увеличиваются только для строк, которые действительно
+        # перешли из pending (строку с истекшей арендой мог обработать другой воркер)
+        await self.db.execute("""
+            WITH updated AS (
+                UPDATE notification_outbox o
+                SET status = r.status,
+                    last_error = r.error,
+                    next_attempt_at = CASE WHEN r.status = 'pending'
+                                           THEN NOW() + r.retry_in * INTERVAL '1 second'
+                                           ELSE o.next_attempt_at END,
+                    updated_at = NOW()
+                FROM unnest(%s::bigint[], %s::text[], %s::text[], %s::int[]) AS r(id, status, error, retry_in)
+                WHERE o.id = r.id AND o.status = 'pending'
+                RETURNING o.broadcast_id, o.status
+            )
+            UPDATE broadcasts b
+            SET sent = b.sent + c.sent, failed = b.failed + c.failed, blocked = b.blocked + c.blocked
+            FROM (
+                SELECT broadcast_id,
+                       COUNT(*) FILTER (WHERE status = 'sent') AS sent,
+                       COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+                       COUNT(*) FILTER (WHERE status = 'blocked') AS blocked
+                FROM updated
+                GROUP BY broadcast_id
+            ) c
+            WHERE b.id = c.broadcast_id
+        """, (ids, statuses, errors, retry_in))
+
+    async def _report_progress(self, broadcasts):
+        """
+        Обновляет сообщение о прогрессе у инициатора рассылки (не чаще
+        progress_interval) и закрывает рассылки, в которых ничего не осталось
+        """
+        rows = await self.db.fetchall("""
+            SELECT id, total, sent, failed, blocked, recipients_complete FROM broadcasts WHERE id = ANY(%s)
+        """, (list(broadcasts),))
+
+        now = time.monotonic()
+        for row in rows:
+            await self._update_progress(broadcasts[row['id']], row, now)
+
+    async def _update_progress(self, broadcast, row, now):
+        result = BroadcastResult(total=row['total'], sent=row['sent'],
+                                 failed=row['failed'], blocked=row['blocked'])
+        done = row['recipients_complete'] and result.done
+        if done:
+            await self._finish(broadcast)
+        elif now - self._last_progress.get(broadcast['id'], 0) < self.progress_interval:
+            return
+        else:
+            self._last_progress[broadcast['id']] = now
+        if broadcast['status_chat_id']:
+            await self._edit_progress(broadcast, result, done)
+
+    async def _edit_progress(self, broadcast, result, done):
+        if done:
+            text = f"✅ Рассылка завершена: доставлено {result.sent} из {result.total}"
+            if result.blocked + result.failed:
+                text += f" (недоступны: {result.blocked + result.failed})"
+        else:
+            text = f"📨 Рассылка уведомлений: {result.processed} из {result.total}…"
+        try:
+            await self.broadcaster.bot.edit_message_text(
+                text, chat_id=broadcast['status_chat_id'], message_id=broadcast['status_message_id'])
+        except Exception as e:
+            # В том числе "message is not modified" - прогресс не изменился
+            logger.debug(f"Не удалось обновить прогресс рассылки {broadcast['id']}: {e}")
+
+    async def _finish(self, broadcast):
+        await self.db.execute("""
+            UPDATE broadcasts SET completed_at = NOW() WHERE id = %s AND completed_at IS NULL
+        """, (broadcast['id'],))
+        self._broadcasts.pop(broadcast['id'], None)
+        self._last_progress.pop(broadcast['id'], None)
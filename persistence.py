@@ -0,0 +1,208 @@
+"""
+Хранение состояния диалогов и user_data в PostgreSQL, чтобы после
+перезапуска бот не терял вход врача в медцентр и текущие шаги диалогов.
+Если чат переходит на другую реплику (перезапуск, недоступность), она
+перечитывает его состояние из базы при первом обновлении чата
+"""
+
+import asyncio
+import json
+import logging
+import pickle
+
+from psycopg2.extras import execute_values
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей перечисляется в одном событии 'persistence'
+NOTIFY_BATCH = 100
+
+
+class PostgresPersistence(BasePersistence):
+    """
+    Persistence для python-telegram-bot: user_data и состояния ConversationHandler
+    в таблице bot_persistence (данные сериализуются pickle).
+    Изменения копятся в памяти и пишутся одной транзакцией не чаще раза
+    в flush_delay секунд (write-behind); flush() при остановке дописывает остаток.
+
+    Данные пользователя и его состояния диалогов перечитываются из базы,
+    когда реплика впервые обрабатывает его обновление, и после того,
+    как их записала другая реплика (событие 'persistence' через notify)
+    """
+
+    def __init__(self, db, update_interval=10, flush_delay=1.0, notify=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.flush_delay = flush_delay
+        self.notify = notify
+        self._pending = {}  # (kind, name, key) -> данные или None для удаления
+        self._flush_task = None
+        # Записи идут по очереди, чтобы старые данные не перезаписали новые
+        self._write_lock = asyncio.Lock()
+        # Записи, которые реплика прочитала из базы или записала сама
+        self._loaded = set()  # (kind, name, key)
+        self._conversation_handlers = {}  # name -> ConversationHandler
+
+    async def get_user_data(self):
+        rows = await self.db.fetchall("SELECT key, data FROM bot_persistence WHERE kind = 'user_data'")
+        return {int(row['key']): pickle.loads(row['data']) for row in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await self.db.fetchall(
+            "SELECT key, data FROM bot_persistence WHERE kind = 'conversation' AND name = %s", (name,))
+        return {tuple(json.loads(row['key'])): pickle.loads(row['data']) for row in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        data = pickle.dumps(new_state) if new_state is not None else None
+        self._stage(('conversation', name, json.dumps(list(key))), data)
+
+    async def update_user_data(self, user_id, data):
+        # Сериализуем сразу: словарь продолжит меняться до записи
+        self._stage(('user_data', '', str(user_id)), pickle.dumps(data))
+
+    async def drop_user_data(self, user_id):
+        self._stage(('user_data', '', str(user_id)), None)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        item = ('user_data', '', str(user_id))
+        if item in self._loaded or item in self._pending:
+            return
+        data = await self.db.fetchval(
+            "SELECT data FROM bot_persistence WHERE kind = %s AND name = %s AND key = %s", item)
+        self._loaded.add(item)
+        user_data.clear()
+        if data is not None:
+            user_data.update(pickle.loads(data))
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def track_conversation(self, handler):
+        """Регистрирует persistent ConversationHandler для refresh_conversations"""
+        self._conversation_handlers[handler.name] = handler
+
+    async def refresh_conversations(self, update, context):
+        """
+        Обработчик для группы -1 (до ConversationHandler): перечитывает
+        состояния диалогов чата, если реплика их еще не читала
+        """
+        if update.effective_chat is None or update.effective_user is None:
+            return
+        # У ConversationHandler нет публичного способа обновить состояние,
+        # поэтому ключ и словарь состояний берутся из его внутренних полей
+        stale = {}
+        for name, handler in self._conversation_handlers.items():
+            key = json.dumps(list(handler._get_key(update)))
+            item = ('conversation', name, key)
+            if item not in self._loaded and item not in self._pending:
+                stale.setdefault(key, []).append(name)
+        for key, names in stale.items():
+            rows = await self.db.fetchall("""
+                SELECT name, data FROM bot_persistence
+                WHERE kind = 'conversation' AND key = %s AND name = ANY(%s)
+            """, (key, names))
+            states = {row['name']: pickle.loads(row['data']) for row in rows}
+            for name in names:
+                conversations = self._conversation_handlers[name]._conversations
+                # Без учета изменений: прочитанное не нужно записывать обратно
+                if name in states:
+                    conversations.update_no_track({tuple(json.loads(key)): states[name]})
+                else:
+                    conversations.data.pop(tuple(json.loads(key)), None)
+                self._loaded.add(('conversation', name, key))
+
+    def invalidate(self, data):
+        """Обработчик события 'persistence': записи изменила другая реплика"""
+        for item in data.get('items', ()):
+            self._loaded.discard(tuple(item))
+
+    def invalidate_all(self, data=None):
+        """После потери связи с другими репликами все перечитывается заново"""
+        self._loaded.clear()
+
+    async def flush(self):
+        """Записывает все накопленные изменения (вызывается при остановке бота)"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = None
+        await self._write_pending()
+
+    def _stage(self, item, data):
+        self._pending[item] = data
+        self._loaded.add(item)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        await self._write_pending()
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            pending, self._pending = self._pending, {}
+            if pending:
+                await self._write(pending)
+
+    async def _write(self, pending):
+        upserts = [(kind, name, key, data) for (kind, name, key), data in pending.items() if data is not None]
+        deletes = [item for item, data in pending.items() if data is None]
+
+        def write(cursor):
+            if upserts:
+                execute_values(cursor, """
+                    INSERT INTO bot_persistence (kind, name, key, data) VALUES %s
+                    ON CONFLICT (kind, name, key)
+                    DO UPDATE SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+                """, upserts)
+            if deletes:
+                execute_values(cursor, """
+                    DELETE FROM bot_persistence p
+                    USING (VALUES %s) AS d (kind, name, key)
+                    WHERE p.kind = d.kind AND p.name = d.name AND p.key = d.key
+                """, deletes)
+
+        try:
+            await self.db.run(write)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние диалогов: {e}")
+            # Возвращаем в очередь то, что не успело смениться более новыми данными
+            for item, data in pending.items():
+                self._pending.setdefault(item, data)
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            return
+
+        if self.notify is not None:
+            # Другие реплики перечитают эти записи; NOTIFY ограничен 8000 байт
+            items = [list(item) for item in pending]
+            for i in range(0, len(items), NOTIFY_BATCH):
+                self.notify('persistence', items=items[i:i + NOTIFY_BATCH])
@@ -0,0 +1,54 @@
+"""
+Напоминания донорам о том, что они снова могут сдавать кровь.
+
+Раз в день выбираются доноры, у которых наступила дата eligible_from,
+пачками по частичному индексу. Отметка users.eligibility_reminded_for
+ставится в одной транзакции с постановкой в очередь рассылок (outbox),
+поэтому за один цикл (до следующей сдачи) донор получает одно напоминание,
+а перезапуск бота не отправляет его повторно
+"""
+
+REMINDER_MESSAGE = (
+    "🩸 Прошло достаточно времени с вашей последней сдачи крови - вы снова можете стать донором!\n\n"
+    "Найти центры, которым нужна ваша кровь, можно через меню «Хочу сдать кровь»."
+)
+
+# Если бот не работал в день наступления даты, напоминание уходит в следующие дни
+CATCHUP_DAYS = 3
+
+_DUE_CONDITION = """
+    role = 'user' AND is_registered = TRUE
+    AND eligible_from BETWEEN CURRENT_DATE - %s AND CURRENT_DATE
+    AND eligibility_reminded_for IS DISTINCT FROM eligible_from
+"""
+
+_MARK_DUE_SQL = f"""
+    WITH due AS (
+        SELECT telegram_id FROM users
+        WHERE {_DUE_CONDITION}
+        ORDER BY eligible_from, telegram_id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE users u SET eligibility_reminded_for = u.eligible_from
+    FROM due WHERE u.telegram_id = due.telegram_id
+    RETURNING u.telegram_id
+"""
+
+
+async def queue_reminders(db, outbox, batch_size=500, catchup_days=CATCHUP_DAYS):
+    """Ставит напоминания в очередь рассылок, возвращает число доноров"""
+    def mark_due(cursor):
+        cursor.execute(_MARK_DUE_SQL, (catchup_days, batch_size))
+        return [row['telegram_id'] for row in cursor.fetchall()]
+
+    if not await db.fetchval(f"SELECT EXISTS (SELECT 1 FROM users WHERE {_DUE_CONDITION})", (catchup_days,)):
+        return 0
+    broadcast_id = await outbox.create_broadcast('reminder', REMINDER_MESSAGE)
+    total = 0
+    while True:
+        queued = await outbox.add_recipients_from(broadcast_id, mark_due)
+        if not queued:
+            await outbox.complete_recipients(broadcast_id)
+            return total
+        total += queued
@@ -0,0 +1,124 @@
+"""
+Маршрутизатор webhook для нескольких реплик бота.
+
+Telegram присылает все обновления на один адрес; маршрутизатор отправляет
+обновления одного чата всегда на одну и ту же реплику (rendezvous hashing
+по id чата), поэтому порядок шагов диалога сохраняется, а кэши реплик
+работают на своих пользователей. Если реплика недоступна, обновление
+уходит на следующую по рангу. Ответ реплики (например, 503 при переполненной
+очереди) передается Telegram как есть.
+
+Запуск:
+    REPLICAS=http://bot-1:8080,http://bot-2:8080 python router.py
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+
+import aiohttp
+from aiohttp import web
+
+from webhook import SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+
+def chat_id_of(update):
+    """id чата (или пользователя) обновления; для обновлений без чата - update_id"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        # Как effective_chat в PTB: у callback_query чат берется из сообщения
+        sources = (value, value.get('message'))
+        for field in ('chat', 'from', 'user'):
+            for source in sources:
+                if isinstance(source, dict) and isinstance(source.get(field), dict) and 'id' in source[field]:
+                    return source[field]['id']
+    return update.get('update_id', 0)
+
+
+def rank_replicas(replicas, key):
+    """Реплики в порядке предпочтения для ключа (rendezvous hashing)"""
+    def weight(replica):
+        return hashlib.blake2b(f"{replica}|{key}".encode(), digest_size=8).digest()
+    return sorted(replicas, key=weight, reverse=True)
+
+
+class WebhookRouter:
+    def __init__(self, replicas, path='/telegram', secret_token=None, timeout=10.0):
+        self.replicas = list(replicas)
+        self.path = path
+        self.secret_token = secret_token
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.forwarded = {replica: 0 for replica in self.replicas}
+        self._session = None
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get('/health', self.handle_health)
+        self.app.on_startup.append(self._open_session)
+        self.app.on_cleanup.append(self._close_session)
+
+    async def handle_update(self, request):
+        if self.secret_token is not None:
+            token = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(token, self.secret_token):
+                return web.Response(status=403)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+
+        headers = {'Content-Type': 'application/json'}
+        if self.secret_token is not None:
+            headers[SECRET_HEADER] = self.secret_token
+        for replica in rank_replicas(self.replicas, chat_id_of(update)):
+            try:
+                async with self._session.post(replica + self.path, data=body, headers=headers) as response:
+                    self.forwarded[replica] += 1
+                    return web.Response(status=response.status, headers=_retry_after(response))
+            except (aiohttp.ClientConnectionError, TimeoutError) as e:
+                logger.warning(f"Реплика {replica} недоступна: {e}")
+        # Telegram повторит доставку позже
+        return web.Response(status=503, headers={'Retry-After': '1'})
+
+    async def handle_health(self, request):
+        return web.json_response({'forwarded': self.forwarded})
+
+    async def _open_session(self, app):
+        self._session = aiohttp.ClientSession(timeout=self.timeout)
+
+    async def _close_session(self, app):
+        if self._session is not None:
+            await self._session.close()
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    return {'Retry-After': value} if value else {}
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    replicas = [url.strip().rstrip('/') for url in os.getenv('REPLICAS', '').split(',') if url.strip()]
+    if not replicas:
+        raise SystemExit("REPLICAS не задан")
+    router = WebhookRouter(
+        replicas,
+        path=os.getenv('WEBHOOK_PATH', '/telegram'),
+        secret_token=os.getenv('WEBHOOK_SECRET') or None,
+    )
+    web.run_app(router.app, host=os.getenv('ROUTER_LISTEN', '0.0.0.0'), port=int(os.getenv('ROUTER_PORT', '8443')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Общие ресурсы бота: пул соединений, исполнитель запросов, кэши и связь
+с другими репликами. Создаются один раз при запуске и передаются
+в BloodDonorBot и UserFunctions, обработчики ничего из этого не создают сами
+"""
+
+import logging
+import os
+
+from cache import TTLCache
+from cluster import LeaderElection, ReplicaEvents
+from database import ConnectionPool, Database
+from geo import GridIndex
+from migrate import migrate
+from needs_board import NeedsBoard
+from traffic_light import TrafficLights
+
+logger = logging.getLogger(__name__)
+
+
+def db_config_from_env():
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'database': os.getenv('DB_NAME', 'blood_donor_bot'),
+        'user': os.getenv('DB_USER', 'postgres'),
+        'password': os.getenv('DB_PASSWORD', 'vadamahjkl'),
+        'port': os.getenv('DB_PORT', '5432')
+    }
+
+
+class Services:
+    """Контейнер общих сервисов; настройки пула и кэшей берутся из окружения"""
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.pool = ConnectionPool(
+            db_config,
+            min_size=int(os.getenv('DB_POOL_MIN', '1')),
+            max_size=int(os.getenv('DB_POOL_MAX', '10')),
+            acquire_timeout=float(os.getenv('DB_POOL_TIMEOUT', '5')),
+        )
+        self.db = Database(
+            self.pool,
+            workers=int(os.getenv('DB_WORKERS', '8')),
+            queue_size=int(os.getenv('DB_QUEUE_SIZE', '100')),
+        )
+        self.centers_index = GridIndex()
+        self.traffic_lights = TrafficLights(self.db)
+        self.needs_board = NeedsBoard()
+        self.relevant_requests_cache = TTLCache(ttl=float(os.getenv('RELEVANT_REQUESTS_CACHE_TTL', '60')))
+        self.user_cache = TTLCache(ttl=float(os.getenv('USER_CACHE_TTL', '300')),
+                                   maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')))
+        # Несколько реплик: кэши сбрасываются по событиям с других реплик
+        self.events = ReplicaEvents(db_config, self.db) if os.getenv('REPLICA_EVENTS') == '1' else None
+        # Задачи в единственном экземпляре выполняет только ведущая реплика
+        self.leader = LeaderElection(db_config, interval=float(os.getenv('LEADER_INTERVAL', '15')))
+        self._database_ready = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(db_config_from_env())
+
+    def init_database(self):
+        """Приводит схему базы данных к последней версии (миграции из migrations/), один раз"""
+        if self._database_ready:
+            return
+        try:
+            self.pool.open()
+            with self.pool.connection() as conn:
+                applied = migrate(conn)
+            if applied:
+                logger.info(f"База данных обновлена, применены миграции: {', '.join(applied)}")
+            else:
+                logger.info("Схема базы данных актуальна")
+            self._database_ready = True
+        except Exception as e:
+            logger.error(f"Ошибка инициализации базы данных: {e}")
+
+    def get_db_connection(self):
+        """
+        Берет соединение из общего пула (close() возвращает его обратно).
+        Только для синхронного кода вне event loop, обработчики используют db
+        """
+        return self.pool.get_connection()
+
+    async def get_user_profile(self, user_id):
+        """
+        Профиль пользователя (роль, группа крови, местоположение, медцентр, справка)
+        из кэша или из базы; None - пользователя нет. Возвращается копия
+        """
+        profile = self.user_cache.get(user_id)
+        if profile is None:
+            profile = await self.db.fetchone("""
+                SELECT telegram_id, role, is_registered, blood_type, city, location, latitude, longitude,
+                       last_donation_date, medical_center_id, medical_certificate_date
+                FROM users WHERE telegram_id = %s
+            """, (user_id,)) or {}
+            self.user_cache.set(user_id, profile)
+        return dict(profile) if profile else None
+
+    def invalidate_user(self, user_id, notify=True):
+        """Сбрасывает кэшированные данные пользователя после записи в users"""
+        self.user_cache.invalidate(user_id)
+        self.relevant_requests_cache.invalidate(user_id)
+        if notify:
+            self.notify('user', id=user_id)
+
+    def notify(self, kind, **data):
+        """Сообщает другим репликам об изменении данных (если реплик несколько)"""
+        if self.events is not None:
+            self.events.publish(kind, **data)
+
+    def subscribe(self, kind, callback):
+        if self.events is not None:
+            self.events.subscribe(kind, callback)
+
+    def start(self):
+        """Запускает связь с другими репликами (из event loop)"""
+        if self.events is not None:
+            self.subscribe('user', lambda data: self.invalidate_user(data['id'], notify=False))
+            self.subscribe('requests', lambda data: self.relevant_requests_cache.clear())
+            self.subscribe('reset', lambda data: self.clear_caches())
+            self.events.start()
+        self.leader.start()
+
+    async def stop(self):
+        if self.events is not None:
+            await self.events.stop()
+        await self.leader.stop()
+
+    def clear_caches(self):
+        self.user_cache.clear()
+        self.relevant_requests_cache.clear()
+        self.traffic_lights.invalidate()
+
+    def close(self):
+        self.db.close()
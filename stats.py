@@ -0,0 +1,80 @@
+"""
+Статистика пользователей из материализованного представления donor_stats
+(миграция 0010). Представление пересчитывает фоновая задача, поэтому экраны
+статистики не сканируют users: строк в нем не больше, чем сочетаний
+роли, группы крови и города, сколько бы ни было пользователей.
+Так же пересчитывается response_stats - число откликов доноров по запросам
+"""
+
+from traffic_light import BLOOD_TYPES
+
+_BLOOD_TYPE_ORDER = {bt: i for i, bt in enumerate(BLOOD_TYPES)}
+
+
+async def refresh_stats(db):
+    """Пересчитывает donor_stats и response_stats, не блокируя чтение"""
+    await db.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY donor_stats")
+    await db.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY response_stats")
+
+
+async def load_recent_requests(db, limit=5):
+    """
+    Последние запросы крови с числом откликов из response_stats и общее
+    число откликов: ([{'blood_type', 'location', 'hospital_name', 'address',
+    'request_date', 'response_count'}], total_responses)
+    """
+    def collect(cursor):
+        # Порядок по первичному ключу совпадает с порядком создания запросов
+        cursor.execute("""
+            SELECT dr.blood_type, dr.location,
+                   COALESCE(dr.hospital_name, 'Не указано') as hospital_name,
+                   COALESCE(dr.address, 'Адрес не указан') as address,
+                   dr.request_date,
+                   COALESCE(rs.responses, 0) as response_count
+            FROM donation_requests dr
+            LEFT JOIN response_stats rs ON rs.request_id = dr.id
+            ORDER BY dr.id DESC
+            LIMIT %s
+        """, (limit,))
+        recent_requests = cursor.fetchall()
+        cursor.execute("SELECT responses FROM response_stats WHERE request_id = 0")
+        row = cursor.fetchone()
+        return recent_requests, row['responses'] if row else 0
+
+    return await db.run(collect)
+
+
+async def load_stats(db, top_cities=5):
+    """
+    Сводка: {'donors', 'new_donors', 'eligible', 'doctors', 'total_users',
+    'by_blood_type': [{'blood_type', 'donors', 'new_donors', 'eligible'}],
+    'top_cities': [{'city', 'donors'}]}; группа крови '' - не указана
+    """
+    rows = await db.fetchall("SELECT role, blood_type, city_key, city, users, new_donors, eligible FROM donor_stats")
+
+    summary = {'donors': 0, 'new_donors': 0, 'eligible': 0, 'doctors': 0}
+    by_blood_type = {}
+    by_city = {}
+    for row in rows:
+        if row['role'] != 'user':
+            summary['doctors'] += row['users']
+            continue
+        summary['donors'] += row['users']
+        summary['new_donors'] += row['new_donors']
+        summary['eligible'] += row['eligible']
+
+        group = by_blood_type.setdefault(row['blood_type'], {
+            'blood_type': row['blood_type'], 'donors': 0, 'new_donors': 0, 'eligible': 0})
+        group['donors'] += row['users']
+        group['new_donors'] += row['new_donors']
+        group['eligible'] += row['eligible']
+
+        if row['city_key']:
+            city = by_city.setdefault(row['city_key'], {'city': row['city'] or row['city_key'], 'donors': 0})
+            city['donors'] += row['users']
+
+    summary['total_users'] = summary['donors'] + summary['doctors']
+    summary['by_blood_type'] = sorted(by_blood_type.values(),
+                                      key=lambda g: _BLOOD_TYPE_ORDER.get(g['blood_type'], len(BLOOD_TYPES)))
+    summary['top_cities'] = sorted(by_city.values(), key=lambda c: -c['donors'])[:top_cities]
+    return summary
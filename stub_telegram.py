@@ -0,0 +1,118 @@
+"""
+Заглушка Telegram Bot API для локальной проверки режима webhook.
+
+Отвечает на методы Bot API, которыми пользуется бот, запоминает адрес
+и секрет из setWebhook и по запросу к /push отправляет боту обновление
+так же, как это делает Telegram.
+
+Запуск:
+    python stub_telegram.py                   # заглушка на :8081
+    TELEGRAM_API_URL=http://localhost:8081 BOT_MODE=webhook \\
+    WEBHOOK_URL=http://localhost:8080/telegram python bot_debug.py
+    curl 'http://localhost:8081/push?chat_id=1&text=/start'
+"""
+
+import argparse
+import itertools
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'StubBot', 'username': 'stub_bot'}
+
+
+class StubTelegram:
+    def __init__(self):
+        self.webhook_url = None
+        self.secret_token = None
+        self.calls = {}  # метод Bot API -> число вызовов
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._session = None
+
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle_method)
+        self.app.router.add_get('/push', self.handle_push)
+        self.app.router.add_get('/stats', self.handle_stats)
+        self.app.on_cleanup.append(self._close_session)
+
+    async def handle_method(self, request):
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post()) if request.can_read_body else {}
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.secret_token = params.get('secret_token')
+            logger.info(f"setWebhook: {self.webhook_url}")
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook_url = None
+            result = True
+        elif method == 'getUpdates':
+            result = []
+        elif method in ('sendMessage', 'editMessageText', 'sendPhoto'):
+            chat_id = int(params.get('chat_id') or 0)
+            result = self.message(chat_id, params.get('text') or '', from_bot=True)
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_push(self, request):
+        """Отправляет боту текстовое сообщение от пользователя chat_id"""
+        chat_id = int(request.query.get('chat_id', '1'))
+        status = await self.push(self.text_update(chat_id, request.query.get('text', '/start')))
+        return web.json_response({'status': status})
+
+    async def handle_stats(self, request):
+        return web.json_response(self.calls)
+
+    def message(self, chat_id, text, from_bot=False):
+        user = BOT_USER if from_bot else {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'}
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': user,
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return message
+
+    def text_update(self, chat_id, text):
+        return {'update_id': next(self._update_ids), 'message': self.message(chat_id, text)}
+
+    async def push(self, update):
+        """Доставляет обновление на зарегистрированный webhook, возвращает HTTP-статус"""
+        if not self.webhook_url:
+            raise web.HTTPConflict(text="Webhook не зарегистрирован")
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.secret_token} if self.secret_token else {}
+        async with self._session.post(self.webhook_url, json=update, headers=headers) as response:
+            return response.status
+
+    async def _close_session(self, app):
+        if self._session is not None:
+            await self._session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    web.run_app(StubTelegram().app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Донорский светофор медцентра в памяти: статусы 8 групп крови упакованы
+в одно число (по 2 бита на группу), клавиатура строится один раз
+на каждое сочетание статусов
+"""
+
+from functools import lru_cache
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+BLOOD_TYPES = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+STATUSES = ('ok', 'need', 'urgent')
+STATUS_EMOJIS = {'ok': '🟢', 'need': '🟡', 'urgent': '🔴'}
+
+_BLOOD_TYPE_INDEX = {bt: i for i, bt in enumerate(BLOOD_TYPES)}
+_STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# Следующий статус по кругу ok -> need -> urgent -> ok за одно обращение к БД;
+# новая строка создается сразу со статусом 'need' (по умолчанию было 'ok')
+TOGGLE_SQL = """
+    INSERT INTO blood_needs (medical_center_id, blood_type, status)
+    VALUES (%s, %s, 'need')
+    ON CONFLICT (medical_center_id, blood_type)
+    DO UPDATE SET status = CASE blood_needs.status
+                               WHEN 'ok' THEN 'need'
+                               WHEN 'need' THEN 'urgent'
+                               ELSE 'ok'
+                           END,
+                  updated_at = CURRENT_TIMESTAMP
+    RETURNING status
+"""
+
+
+def pack(status_map):
+    """Упаковывает {группа крови: статус} в число; отсутствующие группы - 'ok'"""
+    vector = 0
+    for bt, status in status_map.items():
+        vector = with_status(vector, bt, status)
+    return vector
+
+
+def status_of(vector, blood_type):
+    return STATUSES[(vector >> (2 * _BLOOD_TYPE_INDEX[blood_type])) & 0b11]
+
+
+def with_status(vector, blood_type, status):
+    """Новый вектор, в котором у blood_type статус status"""
+    shift = 2 * _BLOOD_TYPE_INDEX[blood_type]
+    return (vector & ~(0b11 << shift)) | (_STATUS_CODES.get(status, 0) << shift)
+
+
+@lru_cache(maxsize=len(STATUSES) ** len(BLOOD_TYPES))
+def keyboard(vector):
+    """Клавиатура светофора для вектора статусов (строится один раз на вектор)"""
+    rows = []
+    row = []
+    for bt in BLOOD_TYPES:
+        row.append(InlineKeyboardButton(f"{bt} {STATUS_EMOJIS[status_of(vector, bt)]}",
+                                        callback_data=f"tl_toggle_{bt}"))
+        if len(row) == 2:
+            rows.append(row)
+            row = []
+    rows.append([InlineKeyboardButton("🔙 В меню", callback_data="back_to_menu")])
+    return InlineKeyboardMarkup(rows)
+
+
+class TrafficLights:
+    """
+    Векторы статусов по медцентрам. Загружаются из blood_needs при первом
+    обращении и обновляются сразу после записи в базу (write-through)
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._vectors = {}  # mc_id -> вектор статусов
+
+    async def get(self, mc_id):
+        vector = self._vectors.get(mc_id)
+        if vector is None:
+            rows = await self.db.fetchall(
+                "SELECT blood_type, status FROM blood_needs WHERE medical_center_id = %s", (mc_id,),
+                label='traffic_light_load')
+            vector = pack({row['blood_type']: row['status'] for row in rows
+                           if row['blood_type'] in _BLOOD_TYPE_INDEX})
+            self._vectors[mc_id] = vector
+        return vector
+
+    async def toggle(self, mc_id, blood_type):
+        """Переключает статус группы крови, возвращает (новый статус, вектор)"""
+        status = await self.db.fetchval(TOGGLE_SQL, (mc_id, blood_type), label='traffic_light_toggle')
+        vector = self._vectors.get(mc_id)
+        if vector is None:
+            vector = await self.get(mc_id)
+        else:
+            vector = with_status(vector, blood_type, status)
+            self._vectors[mc_id] = vector
+        return status, vector
+
+    def invalidate(self, mc_id=None):
+        if mc_id is None:
+            self._vectors.clear()
+        else:
+            self._vectors.pop(mc_id, None)
@@ -0,0 +1,91 @@
+"""
+Параллельная обработка обновлений с сохранением порядка внутри одного чата
+"""
+
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления разных чатов обрабатываются параллельно, не больше
+    max_concurrent_updates одновременно; обновления одного чата - строго
+    по очереди в порядке поступления, чтобы переходы ConversationHandler
+    не перемешивались. Пока обновление ждет своей очереди в чате,
+    оно не занимает общий слот.
+
+    max_pending ограничивает число обновлений, принятых через accept()
+    и еще не обработанных (в очереди, в ожидании своего чата и в работе):
+    очередь приложения разбирается сразу, поэтому ограничивать нужно здесь
+    """
+
+    def __init__(self, max_concurrent_updates, max_pending=None):
+        super().__init__(max_concurrent_updates)
+        self.max_pending = max_pending
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats = {}  # ключ чата -> [lock, число ожидающих обновлений]
+        self._accepted = set()  # принятые обновления, которые еще не обработаны
+
+    def accept(self, update):
+        """Берет место для обновления; False - уже принято max_pending обновлений"""
+        if self.max_pending is not None and len(self._accepted) >= self.max_pending:
+            return False
+        self._accepted.add(update)
+        return True
+
+    async def process_update(self, update, coroutine):
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            self._accepted.discard(update)
+
+    async def _process_in_order(self, update, coroutine):
+        key = self._chat_key(update)
+        if key is None:
+            async with self._slots:
+                await self.do_process_update(update, coroutine)
+            return
+
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock пропускает ожидающих по очереди, а задачи создаются
+            # в порядке поступления обновлений - порядок в чате сохраняется
+            async with entry[0]:
+                async with self._slots:
+                    await self.do_process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def active_chats(self):
+        return len(self._chats)
+
+    @property
+    def pending(self):
+        return len(self._accepted)
+
+    @staticmethod
+    def _chat_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
@@ -0,0 +1,121 @@
+"""
+Прием обновлений Telegram через webhook на aiohttp вместо long polling.
+
+Telegram присылает обновления POST-запросами; сервер проверяет секретный
+заголовок и кладет обновление в update_queue приложения. Число принятых и еще
+не обработанных обновлений ограничено (ChatOrderedUpdateProcessor.accept):
+если бот не успевает, сервер отвечает 503 и Telegram повторит доставку позже.
+Несколько реплик за балансировщиком принимают обновления на один URL.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления для application"""
+
+    def __init__(self, application, listen='0.0.0.0', port=8080, path='/telegram', secret_token=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get('/health', self.handle_health)
+
+    async def handle_update(self, request):
+        if self.secret_token is not None:
+            token = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(token, self.secret_token):
+                return web.Response(status=403)
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400)
+
+        update = Update.de_json(data, self.application.bot)
+        if update is None:
+            return web.Response(status=400)
+        if not self.application.update_processor.accept(update):
+            # Telegram повторит доставку, когда бот разгрузится
+            self.rejected += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        self.application.update_queue.put_nowait(update)
+        self.received += 1
+        return web.Response()
+
+    async def handle_health(self, request):
+        return web.json_response({
+            'pending': self.application.update_processor.pending,
+            'received': self.received,
+            'rejected': self.rejected,
+        })
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Webhook слушает http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve(application, server, webhook_url=None, drop_pending_updates=False):
+    """
+    Полный цикл работы приложения в режиме webhook: запуск (с post_init),
+    регистрация webhook в Telegram, ожидание SIGINT/SIGTERM и остановка
+    """
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    # Application.initialize() не вызывает post_init/post_shutdown - это делает
+    # run_polling, поэтому здесь повторяем его последовательность вручную
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url,
+                secret_token=server.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=drop_pending_updates,
+            )
+            logger.info(f"Webhook зарегистрирован: {webhook_url}")
+
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)